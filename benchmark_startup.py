@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准测试
+多次冷启动 server_optimizer（与 run_optimizer.sh 相同，通过 launcher.py 运行），
+启动耗时中位数超过预算时返回非零退出码，用于防止启动变慢
+
+默认测量不访问网络、但与正常运行一样推荐配置（扫描进程列表）并加载配置的路径：
+    --profile auto git-cache --cache-dir <空目录> stats
+也可以把要测量的 server_optimizer 参数放在 -- 之后：
+    python3 benchmark_startup.py --runs 10 -- --suggest-profile
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(command, runs: int) -> list:
+    """运行命令若干次，返回每次的耗时（毫秒）"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(label: str, timings: list) -> float:
+    median = statistics.median(timings)
+    p90 = sorted(timings)[int(len(timings) * 0.9) - 1] if len(timings) >= 10 else max(timings)
+    print(f"    • {label:<28} 中位数 {median:6.1f}ms  P90 {p90:6.1f}ms  最小 {min(timings):6.1f}ms")
+    return median
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="server_optimizer 启动耗时基准测试，"
+                                                 "要测量的 server_optimizer 参数放在 -- 之后")
+    parser.add_argument("--runs", type=int, default=20, help="每项测量的运行次数（默认20）")
+    parser.add_argument("--budget-ms", type=float, default=100, help="启动耗时中位数上限（默认100ms）")
+    # server_optimizer 的参数以 - 开头，先取出 -- 之后的部分，避免被当作本脚本的选项
+    argv = list(sys.argv[1:] if argv is None else argv)
+    target_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, target_args = argv[:index], argv[index + 1:]
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if not target_args:
+            # 推荐配置和加载配置都在本地完成，stats 只读取缓存目录，不访问网络
+            target_args = ["--profile", "auto", "git-cache", "--cache-dir", cache_dir, "stats"]
+        launcher_command = [sys.executable, os.path.join(SCRIPT_DIR, "launcher.py")] + target_args
+        script_command = [sys.executable, os.path.join(SCRIPT_DIR, "server_optimizer.py")] + target_args
+        import_command = [sys.executable, os.path.join(SCRIPT_DIR, "launcher.py"), "--list-profiles"]
+
+        # 先运行一次生成 __pycache__ 中的字节码
+        measure(launcher_command, 1)
+
+        print(f"⏱️  启动耗时（{args.runs} 次，{sys.executable}）:")
+        print(f"    参数: {' '.join(target_args)}")
+        summarize("python3 -c pass", measure([sys.executable, "-c", "pass"], args.runs))
+        summarize("launcher.py --list-profiles", measure(import_command, args.runs))
+        median = summarize("python3 launcher.py", measure(launcher_command, args.runs))
+        summarize("python3 server_optimizer.py", measure(script_command, args.runs))
+
+    if median >= args.budget_ms:
+        print(f"❌ 启动耗时中位数 {median:.1f}ms 超出预算 {args.budget_ms:.0f}ms")
+        print(f"   可使用 python3 -X importtime launcher.py {' '.join(target_args)} 查看导入耗时")
+        return 1
+    print(f"✅ 启动耗时中位数 {median:.1f}ms，在预算 {args.budget_ms:.0f}ms 以内")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_optimizer.sh 使用的启动入口
+
+python3 -m 会把当前目录放在 sys.path 最前面，以root运行时当前目录下的 json.py 等同名文件会被导入执行；
+以脚本方式运行时 sys.path[0] 是本文件所在目录。server_optimizer 在这里作为模块导入，仍然复用 __pycache__ 中的字节码
+"""
+
+import sys
+
+import server_optimizer
+
+if __name__ == "__main__":
+    # 帮助信息中显示 server_optimizer.py 而不是本文件名
+    sys.argv[0] = server_optimizer.__file__
+    sys.exit(server_optimizer.main())
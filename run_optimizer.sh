@@ -34,113 +34,84 @@ if [ "$EUID" -ne 0 ]; then
     fi
 fi
 
-# 检查并安装Python3
-echo "🔧 检查Python3..."
-if ! command -v python3 &> /dev/null; then
-    echo "📦 安装Python3..."
-    if command -v apt &> /dev/null; then
-        # Debian/Ubuntu系统
-        echo "使用apt包管理器安装Python3..."
-        apt update
-        apt install -y python3 python3-pip curl
-    elif command -v yum &> /dev/null; then
-        # CentOS/RHEL系统
-        echo "使用yum包管理器安装Python3..."
-        yum install -y python3 python3-pip curl
-    elif command -v dnf &> /dev/null; then
-        # Fedora系统
-        echo "使用dnf包管理器安装Python3..."
-        dnf install -y python3 python3-pip curl
-    else
-        echo "❌ 无法自动安装Python3，请手动安装后重试"
-        echo "Ubuntu/Debian: sudo apt update && sudo apt install python3 python3-pip"
-        echo "CentOS/RHEL: sudo yum install python3 python3-pip"
-        exit 1
-    fi
+# 依赖检查结果缓存在stamp文件中，python3/dig/nslookup的路径都未变化时跳过检查
+# 设置 SERVER_OPTIMIZER_RECHECK=1 可强制重新检查
+if [ "$EUID" -eq 0 ]; then
+    DEPS_STAMP="${SERVER_OPTIMIZER_STATE_DIR:-/var/lib/server_optimizer}/bootstrap.stamp"
 else
-    echo "✅ Python3已安装: $(python3 --version)"
+    DEPS_STAMP="${XDG_CACHE_HOME:-$HOME/.cache}/server_optimizer/bootstrap.stamp"
 fi
+deps_key() {
+    echo "v1 $(command -v python3) $(command -v dig) $(command -v nslookup)"
+}
 
-# 检查并安装pip3
-echo "🔧 检查pip3..."
-if ! command -v pip3 &> /dev/null; then
-    echo "📦 安装pip3..."
-    if command -v apt &> /dev/null; then
-        apt install -y python3-pip
-    elif command -v yum &> /dev/null; then
-        yum install -y python3-pip
-    elif command -v dnf &> /dev/null; then
-        dnf install -y python3-pip
-    else
-        echo "❌ 无法自动安装pip3"
-        exit 1
-    fi
+if [ -z "$SERVER_OPTIMIZER_RECHECK" ] && [ -f "$DEPS_STAMP" ] && [ "$(< "$DEPS_STAMP")" = "$(deps_key)" ]; then
+    echo "✅ 依赖已满足（缓存于 $DEPS_STAMP）"
 else
-    echo "✅ pip3已安装: $(pip3 --version)"
-fi
-
-# 检查并安装requests模块
-echo "🔧 检查Python依赖..."
-if ! python3 -c "import requests" 2>/dev/null; then
-    echo "📦 安装requests模块..."
-    
-    # 尝试使用pip3安装
-    if pip3 install requests; then
-        echo "✅ requests模块安装成功"
-    else
-        echo "⚠️  pip3安装失败，尝试使用系统包管理器..."
-        
-        # 尝试使用系统包管理器安装
+    # 检查并安装Python3
+    echo "🔧 检查Python3..."
+    if ! command -v python3 &> /dev/null; then
+        echo "📦 安装Python3..."
         if command -v apt &> /dev/null; then
-            apt install -y python3-requests
+            # Debian/Ubuntu系统
+            echo "使用apt包管理器安装Python3..."
+            apt update
+            apt install -y python3 curl
         elif command -v yum &> /dev/null; then
-            yum install -y python3-requests
+            # CentOS/RHEL系统
+            echo "使用yum包管理器安装Python3..."
+            yum install -y python3 curl
         elif command -v dnf &> /dev/null; then
-            dnf install -y python3-requests
+            # Fedora系统
+            echo "使用dnf包管理器安装Python3..."
+            dnf install -y python3 curl
         else
-            echo "❌ 无法安装requests模块"
-            echo "请手动安装: pip3 install requests"
+            echo "❌ 无法自动安装Python3，请手动安装后重试"
+            echo "Ubuntu/Debian: sudo apt update && sudo apt install python3"
+            echo "CentOS/RHEL: sudo yum install python3"
             exit 1
         fi
+    else
+        echo "✅ Python3已安装: $(python3 --version)"
     fi
-else
-    echo "✅ requests模块已安装"
-fi
 
-# 检查并安装dig和nslookup
-echo "🔧 检查网络工具..."
-if ! command -v dig &> /dev/null || ! command -v nslookup &> /dev/null; then
-    echo "📦 安装dig和nslookup..."
-    if command -v apt &> /dev/null; then
-        apt install -y dnsutils
-    elif command -v yum &> /dev/null || command -v dnf &> /dev/null; then
-        yum install -y bind-utils
+    # 检查并安装dig和nslookup
+    echo "🔧 检查网络工具..."
+    if ! command -v dig &> /dev/null || ! command -v nslookup &> /dev/null; then
+        echo "📦 安装dig和nslookup..."
+        if command -v apt &> /dev/null; then
+            apt install -y dnsutils
+        elif command -v yum &> /dev/null || command -v dnf &> /dev/null; then
+            yum install -y bind-utils
+        else
+            echo "❌ 无法自动安装dig和nslookup，请手动安装"
+            exit 1
+        fi
     else
-        echo "❌ 无法自动安装dig和nslookup，请手动安装"
-        exit 1
+        echo "✅ dig和nslookup已安装"
     fi
-else
-    echo "✅ dig和nslookup已安装"
-fi
 
+    # 最终验证
+    echo "🔍 最终验证..."
+    if ! command -v python3 &> /dev/null; then
+        echo "❌ Python3验证失败"
+        exit 1
+    fi
+    if ! command -v dig &> /dev/null || ! command -v nslookup &> /dev/null; then
+        echo "❌ dig或nslookup验证失败"
+        exit 1
+    fi
 
-# 最终验证
-echo "🔍 最终验证..."
-if ! python3 -c "import requests" 2>/dev/null; then
-    echo "❌ requests模块验证失败"
-    exit 1
-fi
-if ! command -v dig &> /dev/null || ! command -v nslookup &> /dev/null; then
-    echo "❌ dig或nslookup验证失败"
-    exit 1
+    echo "✅ 所有依赖检查完成"
+    mkdir -p "$(dirname "$DEPS_STAMP")" 2>/dev/null && deps_key > "$DEPS_STAMP" 2>/dev/null
 fi
 
-echo "✅ 所有依赖检查完成"
-
 # 运行优化脚本
 echo
 echo "🚀 开始执行优化..."
-python3 "$SCRIPT_DIR/server_optimizer.py"
+# 通过启动入口运行：server_optimizer 作为模块导入，复用 __pycache__ 中的字节码；
+# 不使用 python3 -m，以免以root运行时导入当前目录下的同名模块
+python3 "$SCRIPT_DIR/launcher.py" "$@"
 
 echo
 echo "优化完成！"
\ No newline at end of file
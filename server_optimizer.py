@@ -6,21 +6,1406 @@
 支持国内和国外服务器的GitHub、Docker、DNS优化
 """
 
-import requests
 import json
 import subprocess
 import sys
 import os
-import platform
-from typing import Dict, List, Optional
+import re
+import argparse
+import contextlib
+import shlex
+import shutil
+import socket
+import threading
+from urllib.parse import unquote, urljoin, urlparse
+from typing import Dict, List, Optional, Tuple
 import time
 
-class ServerOptimizer:
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 随工具发布的内置配置目录，以及用户自定义配置目录（按优先级排列）
+BUILTIN_PROFILE_DIR = os.path.join(SCRIPT_DIR, "profiles")
+USER_PROFILE_DIRS = [
+    os.path.expanduser("~/.config/server_optimizer/profiles"),
+    "/etc/server_optimizer/profiles",
+]
+DEFAULT_PROFILE = "general"
+PROFILE_EXTENSIONS = (".json", ".toml")
+
+# 优化步骤名称 -> 方法名，按执行顺序排列
+OPTIMIZATION_STEPS = {
+    "dns": "optimize_dns",
+    "github": "optimize_github",
+    "gitee": "optimize_gitee",
+    "git": "optimize_git",
+    "git_cache": "optimize_git_cache",
+    "docker": "optimize_docker",
+    "package_mirrors": "optimize_package_mirrors",
+    "ip_preference": "optimize_ip_preference",
+    "proxy_routing": "optimize_proxy_routing",
+    "network": "optimize_network",
+}
+
+# 支持 --revert 撤销的步骤（对应 revert_<step> 方法）
+REVERTIBLE_STEPS = ["git", "git_cache", "ip_preference", "package_mirrors", "proxy_routing"]
+
+# 报告中每个步骤的说明（国内, 海外）
+STEP_DESCRIPTIONS = {
+    "dns": ("使用国内DNS服务器", "使用国际DNS服务器"),
+    "github": ("配置GitHub镜像加速", "配置GitHub官方访问"),
+    "gitee": ("配置Gitee访问优化", "配置Gitee访问优化"),
+    "git": ("设置Git传输参数与镜像仓库改写", "设置Git传输参数"),
+    "git_cache": ("配置本地git镜像缓存", "配置本地git镜像缓存"),
+    "docker": ("设置Docker国内镜像源", "设置Docker镜像源"),
+    "package_mirrors": ("选择最快的pip/apt/yum/npm镜像源", "选择最快的pip/apt/yum/npm镜像源"),
+    "ip_preference": ("按实测结果设置IPv4/IPv6优先级", "按实测结果设置IPv4/IPv6优先级"),
+    "proxy_routing": ("按域名测速选择直连或代理", "按域名测速选择直连或代理"),
+    "network": ("应用网络优化参数", "应用网络优化参数"),
+}
+
+# 常见sysctl参数的内核默认值，用于在报告中列出被修改的参数
+# 部分参数（如tcp_max_syn_backlog）内核会按内存大小调整，这里取常见值
+KERNEL_SYSCTL_DEFAULTS = {
+    "net.core.rmem_max": "212992",
+    "net.core.wmem_max": "212992",
+    "net.core.somaxconn": "4096",
+    "net.core.netdev_max_backlog": "1000",
+    "net.core.default_qdisc": "pfifo_fast",
+    "net.ipv4.tcp_rmem": "4096 131072 6291456",
+    "net.ipv4.tcp_wmem": "4096 16384 4194304",
+    "net.ipv4.tcp_congestion_control": "cubic",
+    "net.ipv4.tcp_window_scaling": "1",
+    "net.ipv4.tcp_timestamps": "1",
+    "net.ipv4.tcp_sack": "1",
+    "net.ipv4.tcp_max_syn_backlog": "1024",
+    "net.ipv4.tcp_max_tw_buckets": "262144",
+    "net.ipv4.tcp_tw_reuse": "2",
+    "net.ipv4.tcp_fin_timeout": "60",
+    "net.ipv4.tcp_keepalive_time": "7200",
+    "net.ipv4.tcp_keepalive_intvl": "75",
+    "net.ipv4.tcp_keepalive_probes": "9",
+    "net.ipv4.tcp_slow_start_after_idle": "1",
+    "net.ipv4.tcp_fastopen": "1",
+    "net.ipv4.tcp_notsent_lowat": "4294967295",
+    "net.ipv4.ip_local_port_range": "32768 60999",
+    "fs.inotify.max_user_watches": "8192",
+    "vm.swappiness": "60",
+    "vm.dirty_ratio": "20",
+    "vm.dirty_background_ratio": "10",
+}
+
+# 用于推荐配置的服务进程名
+SERVICE_PROFILE_HINTS = [
+    ("database", ["mysqld", "mariadbd", "postgres", "mongod", "redis-server", "clickhouse-serv"]),
+    ("web_proxy", ["nginx", "haproxy", "envoy", "caddy", "traefik", "squid"]),
+    ("build_runner", ["gitlab-runner", "Runner.Listener", "act_runner", "buildkitd", "drone-runner-do"]),
+]
+SMALL_VPS_MEMORY_MB = 2048
+
+HOSTS_FILE = "/etc/hosts"
+SYSCTL_CONF_FILE = "/etc/sysctl.conf"
+GAI_CONF_FILE = "/etc/gai.conf"
+DOCKER_DAEMON_FILE = "/etc/docker/daemon.json"
+GIT_CACHE_CRON_FILE = "/etc/cron.d/server_optimizer_git_cache"
+# 仓库名中允许出现的字符（GitHub/Gitee/GitLab）
+REPO_NAME_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._-"
+
+# 记录可回滚修改的状态目录：root使用 /var/lib，普通用户只能修改自己的git/pip/npm配置，状态也记录在自己的目录中
+if os.environ.get("SERVER_OPTIMIZER_STATE_DIR"):
+    STATE_DIR = os.environ["SERVER_OPTIMIZER_STATE_DIR"]
+elif os.geteuid() == 0:
+    STATE_DIR = "/var/lib/server_optimizer"
+else:
+    STATE_DIR = os.path.join(os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+                             "server_optimizer")
+
+# glibc默认优先级表，仅将IPv4映射地址(::ffff:0:0/96)的优先级提到最高
+# 注意：gai.conf中只要出现precedence行就会替换整张默认表，因此需要完整写出
+GAI_PREFER_IPV4 = [
+    "precedence ::1/128       50",
+    "precedence ::/0          40",
+    "precedence 2002::/16     30",
+    "precedence ::/96         20",
+    "precedence ::ffff:0:0/96 100",
+]
+
+
+def _merge_profile(base: Dict, override: Dict) -> Dict:
+    """合并配置：字典递归合并，列表和标量直接覆盖，值为null时删除该项"""
+    merged = dict(base)
+    for key, value in override.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_profile(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _read_profile_file(path: str) -> Dict:
+    """读取单个配置文件（JSON，Python 3.11+ 也支持TOML）"""
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError(f"当前Python不支持TOML配置，请改用JSON: {path}")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_profile(name: str, skip: Optional[str] = None) -> Optional[str]:
+    """按用户目录、内置目录的顺序查找配置文件，返回文件路径"""
+    if os.sep in name or name.endswith(PROFILE_EXTENSIONS):
+        return name if os.path.isfile(name) else None
+
+    for directory in USER_PROFILE_DIRS + [BUILTIN_PROFILE_DIR]:
+        for ext in PROFILE_EXTENSIONS:
+            path = os.path.join(directory, name + ext)
+            # 用户配置可以继承同名的内置配置，此时跳过自身
+            if os.path.isfile(path) and os.path.abspath(path) != skip:
+                return path
+    return None
+
+
+def load_profile(name: str, _seen: Optional[List[str]] = None) -> Dict:
+    """加载配置，并按 inherits 字段逐级合并父配置"""
+    seen = _seen or []
+    path = find_profile(name, skip=seen[-1] if seen else None)
+    if not path:
+        raise ValueError(f"找不到优化配置: {name}")
+    path = os.path.abspath(path)
+    if path in seen:
+        raise ValueError(f"优化配置存在循环继承: {' -> '.join(seen + [path])}")
+
+    data = _read_profile_file(path)
+    data.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    parent = data.pop("inherits", None)
+    if parent:
+        data = _merge_profile(load_profile(parent, seen + [path]), data)
+    data["path"] = path
+    return data
+
+
+def list_profiles() -> Dict[str, str]:
+    """列出所有可用配置，返回 名称 -> 文件路径（用户配置优先）"""
+    profiles = {}
+    for directory in [BUILTIN_PROFILE_DIR] + USER_PROFILE_DIRS[::-1]:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(filename)
+            if ext in PROFILE_EXTENSIONS:
+                profiles[name] = os.path.join(directory, filename)
+    return profiles
+
+
+def detect_memory_mb() -> int:
+    """读取 /proc/meminfo 获取物理内存大小（MB）"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def detect_running_services() -> List[str]:
+    """扫描 /proc 获取正在运行的进程名"""
+    names = set()
+    try:
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    names.add(f.read().strip())
+            except OSError:
+                continue
+    except OSError:
+        pass
+    return sorted(names)
+
+
+def suggest_profile(memory_mb: Optional[int] = None, cpu_count: Optional[int] = None,
+                    services: Optional[List[str]] = None) -> Tuple[str, str]:
+    """根据硬件和运行中的服务推荐配置，返回 (配置名, 推荐原因)"""
+    memory_mb = detect_memory_mb() if memory_mb is None else memory_mb
+    cpu_count = (os.cpu_count() or 1) if cpu_count is None else cpu_count
+    services = detect_running_services() if services is None else services
+
+    if 0 < memory_mb <= SMALL_VPS_MEMORY_MB or cpu_count <= 1:
+        return "small_vps", f"内存 {memory_mb}MB / {cpu_count} 核CPU"
+
+    for profile_name, hints in SERVICE_PROFILE_HINTS:
+        found = [name for name in hints if name in services]
+        if found:
+            return profile_name, f"检测到运行中的服务: {', '.join(found)}"
+
+    return DEFAULT_PROFILE, "未检测到特定工作负载"
+
+
+def sysctl_changes(sysctl: Dict) -> List[Tuple[str, str, str]]:
+    """返回与内核默认值不同的参数列表 (参数, 配置值, 内核默认值)"""
+    return [
+        (key, str(value), KERNEL_SYSCTL_DEFAULTS.get(key, "未知"))
+        for key, value in sysctl.items()
+        if value is not None and str(value) != KERNEL_SYSCTL_DEFAULTS.get(key)
+    ]
+
+
+def update_managed_block(path: str, tag: str, lines: List[str]) -> bool:
+    """在文件中写入（或在lines为空时删除）由本工具管理的配置块，返回文件是否被修改"""
+    begin, end = f"# BEGIN server_optimizer {tag}", f"# END server_optimizer {tag}"
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            original = f.read().splitlines()
+    except FileNotFoundError:
+        original = []
+
+    content, inside = [], False
+    for line in original:
+        if line.strip() == begin:
+            inside = True
+        elif line.strip() == end:
+            inside = False
+        elif not inside:
+            content.append(line)
+
+    if lines:
+        content += [begin] + lines + [end]
+    if content == original:
+        return False
+
+    if os.path.exists(path):
+        shutil.copy2(path, f"{path}.backup.{int(time.time())}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(content) + "\n" if content else "")
+    return True
+
+
+def read_managed_block(path: str, tag: str) -> List[str]:
+    """读取文件中由本工具管理的配置块内容（不含BEGIN/END行）"""
+    begin, end = f"# BEGIN server_optimizer {tag}", f"# END server_optimizer {tag}"
+    block, inside = [], False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return block
+    for line in lines:
+        if line.strip() == begin:
+            inside = True
+        elif line.strip() == end:
+            inside = False
+        elif inside:
+            block.append(line)
+    return block
+
+
+def read_pinned_hosts(path: str, tag: str) -> Dict[str, str]:
+    """读取hosts文件中（本工具 tag 配置块之外）已固定的 主机名 -> 地址"""
+    begin, end = f"# BEGIN server_optimizer {tag}", f"# END server_optimizer {tag}"
+    pinned, inside = {}, False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return pinned
+    for line in lines:
+        if line.strip() == begin:
+            inside = True
+        elif line.strip() == end:
+            inside = False
+        elif not inside:
+            fields = line.split("#", 1)[0].split()
+            for name in fields[1:]:
+                pinned.setdefault(name.lower(), fields[0])
+    return pinned
+
+
+def _split_endpoint(endpoint: str, default_port: int) -> Tuple[str, int]:
+    """解析 host 或 host:port 形式的端点"""
+    host, sep, port = endpoint.rpartition(":")
+    if sep and port.isdigit() and ":" not in host:
+        return host, int(port)
+    return endpoint, default_port
+
+
+def measure_connect(host: str, family: int, port: int = 443, attempts: int = 3,
+                    timeout: float = 3.0) -> Dict:
+    """测量指定地址族下TCP建连的成功率和延迟中位数"""
+    import statistics
+    result = {"address": None, "success_rate": 0.0, "latency_ms": None}
+    try:
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return result
+    if not infos:
+        return result
+
+    sockaddr = infos[0][4]
+    result["address"] = sockaddr[0]
+    latencies = []
+    for _ in range(attempts):
+        start = time.monotonic()
+        try:
+            with socket.socket(family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(sockaddr)
+            latencies.append((time.monotonic() - start) * 1000)
+        except OSError:
+            continue
+
+    result["success_rate"] = len(latencies) / attempts if attempts else 0.0
+    if latencies:
+        result["latency_ms"] = round(statistics.median(latencies), 1)
+    return result
+
+
+def choose_ip_family(v4: Dict, v6: Dict, margin_ms: float = 50) -> Tuple[str, str]:
+    """根据测量结果选择地址族，返回 (ipv4/ipv6/any, 原因)"""
+    if not v6["address"]:
+        return "any", "无AAAA记录，无需调整"
+    if not v4["address"]:
+        return "any", "无A记录，只能使用IPv6"
+    if v6["success_rate"] == 0 and v4["success_rate"] > 0:
+        return "ipv4", "IPv6路径不可达"
+    if v4["success_rate"] == 0 and v6["success_rate"] > 0:
+        return "ipv6", "IPv4路径不可达"
+    if v6["success_rate"] < v4["success_rate"]:
+        return "ipv4", f"IPv6成功率较低 ({v6['success_rate']:.0%} < {v4['success_rate']:.0%})"
+    if v4["success_rate"] < v6["success_rate"]:
+        return "ipv6", f"IPv4成功率较低 ({v4['success_rate']:.0%} < {v6['success_rate']:.0%})"
+    if v4["latency_ms"] is None or v6["latency_ms"] is None:
+        return "any", "两者均不可达"
+    if v6["latency_ms"] > v4["latency_ms"] + margin_ms:
+        return "ipv4", f"IPv6延迟高 {v6['latency_ms'] - v4['latency_ms']:.0f}ms"
+    if v4["latency_ms"] > v6["latency_ms"] + margin_ms:
+        return "ipv6", f"IPv4延迟高 {v4['latency_ms'] - v6['latency_ms']:.0f}ms"
+    return "any", "两者相当"
+
+
+def read_os_release(path: str = "/etc/os-release") -> Dict[str, str]:
+    """解析 /etc/os-release"""
+    info = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep:
+                    info[key] = value.strip('"\'')
+    except OSError:
+        pass
+    return info
+
+
+class HTTPResponse:
+    """HTTPClient返回的响应，读完响应体后连接自动放回连接池"""
+    
+    def __init__(self, client: "HTTPClient", key: Tuple, conn, response, url: str):
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = url
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._content = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def iter_content(self, chunk_size: int = 65536):
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+    
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self._content = self._response.read()
+            self.close()
+        return self._content
+    
+    @property
+    def text(self) -> str:
+        charset = self.headers.get_content_charset() or "utf-8"
+        return self.content.decode(charset, errors="replace")
+    
+    def json(self):
+        return json.loads(self.text)
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}: {self.url}")
+    
+    def close(self):
+        """响应体已完整读取且服务端未要求关闭时复用连接，否则断开"""
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._client._release(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+
+class HTTPClient:
+    """基于标准库http.client的HTTP客户端，按 (协议, 主机, 端口, 代理) 复用keep-alive连接，可在多线程间共享"""
+    
+    MAX_IDLE_PER_HOST = 16
+    MAX_REDIRECTS = 5
+    USER_AGENT = "server_optimizer"
+    
     def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+    
+    @staticmethod
+    def proxy_for(url: str) -> Optional[str]:
+        """与requests一致，读取 http_proxy/https_proxy/all_proxy/no_proxy 环境变量"""
+        import urllib.request
+        parsed = urlparse(url)
+        proxies = urllib.request.getproxies_environment()
+        if not proxies or urllib.request.proxy_bypass_environment(parsed.hostname or "", proxies):
+            return None
+        return proxies.get(parsed.scheme) or proxies.get("all")
+    
+    @staticmethod
+    def via_http_proxy(key: Tuple) -> bool:
+        """明文HTTP经由HTTP代理时直接向代理发送绝对地址请求，不建立CONNECT隧道（与measure_route一致）"""
+        scheme, _, _, proxy = key
+        return scheme == "http" and bool(proxy) and urlparse(proxy).scheme.lower() in ("http", "https")
+    
+    def _connect(self, key: Tuple, timeout: float):
+        import http.client
+        scheme, host, port, proxy = key
+        if self.via_http_proxy(key):
+            proxy_url = urlparse(proxy)
+            sock = socket.create_connection((proxy_url.hostname, proxy_url.port or 8080), timeout=timeout)
+        else:
+            sock = open_proxy_tunnel(host, port, proxy, timeout)
+        if scheme == "https":
+            if self._ssl_context is None:
+                import ssl
+                self._ssl_context = ssl.create_default_context()
+            try:
+                sock = self._ssl_context.wrap_socket(sock, server_hostname=host)
+            except Exception:
+                sock.close()
+                raise
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        # 套接字已连接到目标站点、隧道或HTTP代理
+        conn.sock = sock
+        return conn
+    
+    def _acquire(self, key: Tuple):
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if conn.sock is not None:
+                    return conn
+        return None
+    
+    def _release(self, key: Tuple, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE_PER_HOST:
+                idle.append(conn)
+                return
+        conn.close()
+    
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+    
+    def _send(self, key: Tuple, path: str, headers: Dict[str, str], timeout: float):
+        import http.client
+        conn = self._acquire(key)
+        if conn is not None:
+            conn.sock.settimeout(timeout)
+            try:
+                conn.request("GET", path, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # 空闲连接可能已被服务端关闭，换新连接重试一次
+                conn.close()
+        conn = self._connect(key, timeout)
+        try:
+            conn.request("GET", path, headers=headers)
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+    
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10,
+            stream: bool = False) -> HTTPResponse:
+        """发送GET请求并跟随重定向；stream=False 时立即读取完整响应体"""
+        request_headers = {"User-Agent": self.USER_AGENT, "Accept": "*/*"}
+        request_headers.update(headers or {})
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            scheme = parsed.scheme.lower()
+            if scheme not in ("http", "https") or not parsed.hostname:
+                raise ValueError(f"不支持的URL: {url}")
+            key = (scheme, parsed.hostname, parsed.port or (443 if scheme == "https" else 80),
+                   self.proxy_for(url))
+            path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+            send_headers = request_headers
+            if self.via_http_proxy(key):
+                # 请求行使用绝对地址，http.client会据此生成目标站点的Host头
+                path = parsed._replace(fragment="").geturl()
+                authorization = proxy_authorization(key[3])
+                if authorization:
+                    send_headers = dict(request_headers, **{"Proxy-Authorization": authorization})
+            conn, raw = self._send(key, path, send_headers, timeout)
+            response = HTTPResponse(self, key, conn, raw, url)
+            location = response.headers.get("Location")
+            if response.status_code in (301, 302, 303, 307, 308) and location:
+                response.content
+                url = urljoin(url, location)
+                continue
+            if not stream:
+                response.content
+            return response
+        raise OSError(f"重定向次数过多: {url}")
+
+
+_http_client = None
+
+
+def http_get(url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10,
+             stream: bool = False) -> HTTPResponse:
+    """使用进程内共享的连接池发送GET请求"""
+    global _http_client
+    if _http_client is None:
+        _http_client = HTTPClient()
+    return _http_client.get(url, headers=headers, timeout=timeout, stream=stream)
+
+
+def probe_mirror(url: str, timeout: float = 5.0) -> Dict:
+    """下载镜像站上的一个小索引文件，测量首字节延迟和下载吞吐量"""
+    result = {"url": url, "ok": False, "latency_ms": None, "throughput_kbps": None,
+              "total_ms": None, "error": None}
+    start = time.monotonic()
+    try:
+        with http_get(url, timeout=timeout, stream=True) as response:
+            latency = time.monotonic() - start
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            size = sum(len(chunk) for chunk in response.iter_content(chunk_size=65536))
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+        return result
+
+    total = time.monotonic() - start
+    if size == 0:
+        result["error"] = "空响应"
+        return result
+    result.update({
+        "ok": True,
+        "latency_ms": round(latency * 1000, 1),
+        "throughput_kbps": round(size / 1024 / max(total - latency, 1e-6), 1),
+        "total_ms": round(total * 1000, 1),
+    })
+    return result
+
+
+def git_value_pattern(value: str) -> str:
+    """git config --unset 的值参数是正则表达式，转义后只精确匹配该值"""
+    return "^" + re.sub(r"([.^$*+?()\[\]{}|\\])", r"\\\1", value) + "$"
+
+
+def exact_insteadof_rules(url: str, target: str, target_git: str) -> List[Tuple[str, str, str]]:
+    """返回把 <url> 改写到 target、<url>.git 改写到 target_git 的规则 (url小节, 变量, 值)，推送仍走上游"""
+    base_url = re.sub(r"\.git$", "", url.rstrip("/"))
+    rules = [(target_git, "insteadOf", base_url + ".git"),
+             (target, "insteadOf", base_url),
+             (base_url, "pushInsteadOf", base_url)]
+    # insteadOf 按前缀匹配、最长者优先：为仓库名后可能出现的每个字符写入指向自身的改写，
+    # 使以 <url> 开头的更长仓库名（如 bar -> barbaz）匹配到更长的规则而保持不变
+    rules += [(prefix + char, "insteadOf", prefix + char)
+              for prefix in (base_url, base_url + ".git") for char in REPO_NAME_CHARS]
+    return rules
+
+
+def write_gitconfig_rules(path: str, rules: List[Tuple[str, str, str]], header: str):
+    """将url改写规则一次性写入单独的gitconfig文件（供 include.path 引用）"""
+    def quote(value):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    
+    lines = [f"# {header}"]
+    for section, variable, value in rules:
+        lines += [f"[url {quote(section)}]", f"\t{variable} = {quote(value)}"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, path)
+
+
+def load_state(step: str) -> Dict:
+    """读取某个步骤的回滚状态"""
+    try:
+        with open(os.path.join(STATE_DIR, f"{step}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(step: str, state: Optional[Dict]):
+    """保存某个步骤的回滚状态，state为空时删除"""
+    path = os.path.join(STATE_DIR, f"{step}.json")
+    if not state:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+
+
+def rank_mirrors(results: List[Dict]) -> List[Dict]:
+    """按下载索引文件的总耗时排序，不可用的镜像排在最后"""
+    return sorted(results, key=lambda r: (not r["ok"], r["total_ms"] if r["ok"] else 0))
+
+
+def proxy_authorization(proxy: str) -> Optional[str]:
+    """代理地址中带有用户名时，返回对应的 Proxy-Authorization 头"""
+    import base64
+    parsed = urlparse(proxy)
+    if not parsed.username:
+        return None
+    credentials = f"{unquote(parsed.username)}:{unquote(parsed.password or '')}"
+    return "Basic " + base64.b64encode(credentials.encode()).decode()
+
+
+def open_proxy_tunnel(host: str, port: int, proxy: Optional[str] = None,
+                      timeout: float = 5.0) -> socket.socket:
+    """建立到 host:port 的TCP连接，可经由HTTP(CONNECT)或SOCKS5代理"""
+    if not proxy:
+        return socket.create_connection((host, port), timeout=timeout)
+    
+    parsed = urlparse(proxy)
+    scheme = parsed.scheme.lower()
+    default_port = 1080 if scheme.startswith("socks") else 8080
+    sock = socket.create_connection((parsed.hostname, parsed.port or default_port), timeout=timeout)
+    try:
+        if scheme in ("http", "https"):
+            request = f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            authorization = proxy_authorization(proxy)
+            if authorization:
+                request += f"Proxy-Authorization: {authorization}\r\n"
+            sock.sendall((request + "\r\n").encode())
+            response = b""
+            while b"\r\n\r\n" not in response:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise OSError("代理提前关闭连接")
+                response += chunk
+            status = response.split(b"\r\n", 1)[0].decode(errors="replace")
+            if len(status.split()) < 2 or status.split()[1] != "200":
+                raise OSError(f"代理拒绝CONNECT: {status}")
+        elif scheme in ("socks5", "socks5h"):
+            if parsed.username:
+                sock.sendall(b"\x05\x01\x02")
+            else:
+                sock.sendall(b"\x05\x01\x00")
+            reply = _recv_exact(sock, 2)
+            if reply[1] == 0x02:
+                user = unquote(parsed.username or "").encode()
+                password = unquote(parsed.password or "").encode()
+                sock.sendall(bytes([1, len(user)]) + user + bytes([len(password)]) + password)
+                if _recv_exact(sock, 2)[1] != 0:
+                    raise OSError("SOCKS5认证失败")
+            elif reply[1] != 0x00:
+                raise OSError("SOCKS5代理不支持所需的认证方式")
+            encoded_host = host.encode("idna")
+            sock.sendall(b"\x05\x01\x00\x03" + bytes([len(encoded_host)]) + encoded_host
+                         + port.to_bytes(2, "big"))
+            header = _recv_exact(sock, 4)
+            if header[1] != 0x00:
+                raise OSError(f"SOCKS5连接失败，错误码 {header[1]}")
+            address_length = {0x01: 4, 0x04: 16}.get(header[3])
+            if address_length is None:
+                address_length = _recv_exact(sock, 1)[0]
+            _recv_exact(sock, address_length + 2)
+        else:
+            raise OSError(f"不支持的代理类型: {scheme}")
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise OSError("连接被提前关闭")
+        data += chunk
+    return data
+
+
+def measure_route(url: str, proxy: Optional[str] = None, timeout: float = 5.0,
+                  max_bytes: int = 1024 * 1024) -> Dict:
+    """经由指定路由（直连或代理）请求URL，测量建连耗时、首字节延迟和吞吐量"""
+    import ssl
+    result = {"proxy": proxy, "ok": False, "connect_ms": None, "ttfb_ms": None,
+              "throughput_kbps": None, "total_ms": None, "error": None}
+    parsed = urlparse(url)
+    secure = parsed.scheme == "https"
+    host, port = parsed.hostname, parsed.port or (443 if secure else 80)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    
+    start = time.monotonic()
+    try:
+        # 明文HTTP经由HTTP代理时直接发送绝对地址请求，其余情况建立隧道
+        http_proxy = proxy and urlparse(proxy).scheme.lower() in ("http", "https")
+        extra_headers = ""
+        if http_proxy and not secure:
+            proxy_url = urlparse(proxy)
+            sock = socket.create_connection((proxy_url.hostname, proxy_url.port or 8080), timeout=timeout)
+            target = url
+            authorization = proxy_authorization(proxy)
+            if authorization:
+                extra_headers = f"Proxy-Authorization: {authorization}\r\n"
+        else:
+            sock = open_proxy_tunnel(host, port, proxy, timeout)
+            target = path
+            if secure:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        
+        with sock:
+            sock.settimeout(timeout)
+            result["connect_ms"] = round((time.monotonic() - start) * 1000, 1)
+            sock.sendall((f"GET {target} HTTP/1.1\r\nHost: {parsed.netloc}\r\n{extra_headers}"
+                          "User-Agent: server-optimizer\r\nAccept: */*\r\nConnection: close\r\n\r\n").encode())
+            first = sock.recv(65536)
+            if not first.startswith(b"HTTP/"):
+                raise OSError("无效的HTTP响应")
+            ttfb = time.monotonic()
+            size = len(first)
+            while size < max_bytes:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                size += len(chunk)
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+        return result
+    
+    end = time.monotonic()
+    result.update({
+        "ok": True,
+        "ttfb_ms": round((ttfb - start) * 1000, 1),
+        "throughput_kbps": round(size / 1024 / max(end - ttfb, 1e-6), 1),
+        "total_ms": round((end - start) * 1000, 1),
+    })
+    return result
+
+
+def pac_proxy_directive(proxy: Optional[str]) -> str:
+    """将代理地址转换为PAC文件中的返回值"""
+    if not proxy:
+        return "DIRECT"
+    parsed = urlparse(proxy)
+    address = f"{parsed.hostname}:{parsed.port or (1080 if parsed.scheme.startswith('socks') else 8080)}"
+    if parsed.scheme.startswith("socks"):
+        return f"SOCKS5 {address}; SOCKS {address}"
+    return f"PROXY {address}"
+
+
+class GitMirrorCache:
+    """本地裸仓库镜像缓存：克隆时从本地镜像复用对象，只从上游获取增量"""
+    
+    # 透明模式的改写会把上游地址指向镜像本身，缓存内部的git命令通过
+    # -c url.<上游>.insteadOf=<别名> 以别名访问上游，别名不以上游地址开头，不会被镜像的改写匹配
+    UPSTREAM_ALIAS = "server-optimizer-upstream:"
+    
+    def __init__(self, cache_dir: str, max_size_mb: int = 10240, refresh_interval: int = 600,
+                 dissociate: bool = True):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.refresh_interval = refresh_interval
+        self.dissociate = dissociate
+        self.stats_file = os.path.join(self.cache_dir, "stats.json")
+        # 透明模式（insteadof）的改写规则，通过全局gitconfig的 include.path 引用
+        self.insteadof_file = os.path.join(self.cache_dir, "insteadof.gitconfig")
+    
+    @classmethod
+    def from_profile(cls, profile: Dict) -> "GitMirrorCache":
+        config = profile.get("git_cache", {})
+        return cls(config.get("dir", "/var/cache/server_optimizer/git-mirrors"),
+                   config.get("max_size_mb", 10240),
+                   config.get("refresh_interval", 600),
+                   config.get("dissociate", True))
+    
+    def mirror_path(self, url: str) -> str:
+        """将仓库地址映射为缓存目录下的 host/owner/repo.git"""
+        match = re.match(r"^[\w.-]+@([\w.-]+):(.+)$", url)
+        if match:
+            host, path = match.groups()
+        else:
+            parsed = urlparse(url)
+            host, path = parsed.hostname or "local", parsed.path
+        path = re.sub(r"\.git$", "", path.strip("/"))
+        if not path or ".." in path.split("/"):
+            raise ValueError(f"无法识别的仓库地址: {url}")
+        return os.path.join(self.cache_dir, host.lower(), path + ".git")
+    
+    def _upstream_git(self, url: str) -> List[str]:
+        """返回以 UPSTREAM_ALIAS 访问上游 url 的git命令前缀"""
+        return ["git", "-c", f"url.{url}.insteadOf={self.UPSTREAM_ALIAS}"]
+    
+    @staticmethod
+    def clone_dir_name(url: str, git_args: Optional[List[str]] = None) -> str:
+        """与git相同的默认目录名：仓库名去掉 .git，--bare/--mirror 时加上 .git"""
+        name = re.split(r"[/:]", re.sub(r"(/\.git)?/*$", "", url))[-1]
+        name = re.sub(r"\.git$", "", name)
+        return name + ".git" if any(arg in ("--bare", "--mirror") for arg in git_args or []) else name
+    
+    def _restore_remote_urls(self, repo_dir: str, url: str):
+        """把克隆时写入的别名改回上游地址"""
+        result = subprocess.run(["git", "-C", repo_dir, "config", "--get-regexp", r"^remote\..*\.url$"],
+                                capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            key, _, value = line.partition(" ")
+            if value == self.UPSTREAM_ALIAS:
+                subprocess.run(["git", "-C", repo_dir, "config", key, url], capture_output=True)
+    
+    @contextlib.contextmanager
+    def _lock(self, path: str, shared: bool = False, blocking: bool = True):
+        """基于flock的文件锁，非阻塞模式下获取失败时返回False"""
+        import fcntl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a") as lock_file:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(lock_file, flags if blocking else flags | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _update_stats(self, update):
+        """在锁内读取、修改并写回统计信息"""
+        with self._lock(self.stats_file):
+            stats = self.load_stats()
+            update(stats)
+            tmp_file = f"{self.stats_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=2)
+            os.replace(tmp_file, self.stats_file)
+    
+    def load_stats(self) -> Dict:
+        """读取统计信息，repos 按镜像路径索引（同一仓库的不同地址写法共用一条记录）"""
+        try:
+            with open(self.stats_file, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        stats.setdefault("hits", 0)
+        stats.setdefault("misses", 0)
+        stats.setdefault("evictions", 0)
+        stats.setdefault("repos", {})
+        return stats
+    
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    continue
+        return total
+    
+    def _record(self, url: str, path: str, hit: Optional[bool] = None, refreshed: bool = False):
+        size = self._dir_size(path) if refreshed or hit is False else None
+        
+        def update(stats):
+            now = time.time()
+            repo = stats["repos"].setdefault(path, {"path": path, "hits": 0, "misses": 0})
+            repo["url"] = url
+            if hit is not None:
+                stats["hits" if hit else "misses"] += 1
+                repo["hits" if hit else "misses"] += 1
+                repo["last_used"] = now
+            if refreshed or hit is False:
+                repo["last_refresh"] = now
+            if size is not None:
+                repo["size"] = size
+        self._update_stats(update)
+    
+    def ensure(self, url: str) -> Tuple[str, bool]:
+        """确保仓库已缓存，返回 (镜像路径, 是否命中)"""
+        path = self.mirror_path(url)
+        with self._lock(path):
+            if os.path.isdir(path):
+                hit = True
+            else:
+                hit = False
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                result = subprocess.run(
+                    self._upstream_git(url) + ["clone", "--quiet", "--mirror", self.UPSTREAM_ALIAS, tmp_path],
+                    capture_output=True, text=True)
+                if result.returncode != 0:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    raise RuntimeError(f"创建镜像失败: {result.stderr.strip()}")
+                self._restore_remote_urls(tmp_path, url)
+                os.replace(tmp_path, path)
+        
+        self._record(url, path, hit=hit)
+        if not hit:
+            self.evict()
+        return path, hit
+    
+    def refresh(self, url: str, blocking: bool = True) -> bool:
+        """增量更新单个镜像（git fetch --prune）"""
+        path = self.mirror_path(url)
+        if not os.path.isdir(path):
+            return False
+        with self._lock(path, blocking=blocking) as locked:
+            if not locked:
+                return False
+            result = subprocess.run(
+                self._upstream_git(url) + ["-C", path, "fetch", "--quiet", "--prune",
+                                           self.UPSTREAM_ALIAS, "+refs/*:refs/*"],
+                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"    ⚠️  更新 {url} 失败: {result.stderr.strip()[:200]}")
+            return False
+        self._record(url, path, refreshed=True)
+        return True
+    
+    def refresh_all(self) -> int:
+        """更新所有缓存的镜像，返回成功的数量"""
+        repos = self.load_stats()["repos"].values()
+        return sum(1 for url in [repo["url"] for repo in repos] if self.refresh(url, blocking=False))
+    
+    def refresh_in_background(self, url: str):
+        """镜像超过刷新间隔时，在后台进程中增量更新"""
+        repo = self.load_stats()["repos"].get(self.mirror_path(url), {})
+        if time.time() - repo.get("last_refresh", 0) < self.refresh_interval:
+            return
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "git-cache",
+                          "--cache-dir", self.cache_dir, "refresh", url],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+    
+    def clone(self, url: str, dest: Optional[str] = None, git_args: Optional[List[str]] = None) -> int:
+        """借助本地镜像克隆仓库，返回git的退出码"""
+        path, hit = self.ensure(url)
+        print(f"{'✅ 缓存命中' if hit else '📥 缓存未命中，已创建镜像'}: {path}")
+        if hit:
+            self.refresh_in_background(url)
+        
+        # 对象从镜像复用，引用和增量仍从上游获取
+        dest = dest or self.clone_dir_name(url, git_args)
+        command = self._upstream_git(url) + ["clone", "--reference-if-able", path]
+        if self.dissociate:
+            command.append("--dissociate")
+        command += (git_args or []) + [self.UPSTREAM_ALIAS, dest]
+        # 持有共享锁，防止克隆过程中镜像被淘汰
+        with self._lock(path, shared=True):
+            returncode = subprocess.run(command).returncode
+        if returncode == 0:
+            self._restore_remote_urls(dest, url)
+        return returncode
+    
+    def enable_insteadof(self, url: str):
+        """为已缓存的仓库启用透明模式，并重新生成改写规则文件"""
+        path = self.mirror_path(url)
+        
+        def update(stats):
+            if path in stats["repos"]:
+                stats["repos"][path]["insteadof"] = True
+        self._update_stats(update)
+        self.write_insteadof_config()
+    
+    def disable_insteadof(self):
+        """关闭所有仓库的透明模式并删除改写规则文件"""
+        def update(stats):
+            for repo in stats["repos"].values():
+                repo.pop("insteadof", None)
+        if os.path.exists(self.stats_file):
+            self._update_stats(update)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.insteadof_file)
+    
+    def write_insteadof_config(self, skip: Optional[List[str]] = None) -> int:
+        """按启用了透明模式且仍存在的镜像生成改写规则文件（一次写入），返回包含的仓库数"""
+        repos = [repo for path, repo in self.load_stats()["repos"].items()
+                 if repo.get("insteadof") and path not in (skip or []) and os.path.isdir(path)]
+        rules = []
+        for repo in repos:
+            rules += exact_insteadof_rules(repo["url"], f"file://{repo['path']}", f"file://{repo['path']}")
+        with self._lock(self.insteadof_file):
+            write_gitconfig_rules(self.insteadof_file, rules, "由 server_optimizer git_cache 生成，请勿手动修改")
+        return len(repos)
+    
+    def evict(self) -> List[str]:
+        """缓存超过大小上限时，按最近使用时间淘汰冷仓库，正在使用的仓库会被跳过"""
+        repos = self.load_stats()["repos"]
+        total = sum(repo.get("size", 0) for repo in repos.values())
+        evicted = []
+        for path, repo in sorted(repos.items(), key=lambda item: item[1].get("last_used", 0)):
+            if total <= self.max_size:
+                break
+            with self._lock(path, blocking=False) as locked:
+                if not locked:
+                    continue
+                # 先移除透明模式的改写，之后直接 git clone 该仓库会回到上游
+                if repo.get("insteadof"):
+                    self.write_insteadof_config(skip=evicted + [path])
+                shutil.rmtree(path, ignore_errors=True)
+            total -= repo.get("size", 0)
+            evicted.append(path)
+        
+        if evicted:
+            def update(stats):
+                for path in evicted:
+                    stats["repos"].pop(path, None)
+                stats["evictions"] += len(evicted)
+            self._update_stats(update)
+        return evicted
+    
+    def print_stats(self):
+        stats = self.load_stats()
+        total = stats["hits"] + stats["misses"]
+        size = sum(repo.get("size", 0) for repo in stats["repos"].values())
+        print(f"📂 缓存目录: {self.cache_dir}")
+        print(f"📊 命中 {stats['hits']} / 未命中 {stats['misses']}"
+              f"（命中率 {stats['hits'] / total if total else 0:.0%}），已淘汰 {stats['evictions']}")
+        print(f"💾 占用 {size / 1024 / 1024:.1f}MB / 上限 {self.max_size / 1024 / 1024:.0f}MB")
+        for repo in sorted(stats["repos"].values(), key=lambda repo: -repo.get("last_used", 0)):
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(repo.get("last_used", 0)))
+            print(f"    • {repo['url']}  命中 {repo.get('hits', 0)} / 未命中 {repo.get('misses', 0)}  "
+                  f"{repo.get('size', 0) / 1024 / 1024:.1f}MB  最近使用 {last_used}")
+
+
+class SegmentedDownloader:
+    """多连接分段下载：按实测速度把分段分配到多个等价镜像，支持断点续传和边下载边校验"""
+    
+    PROBE_BYTES = 256 * 1024
+    MIN_SEGMENT = 1024 * 1024
+    MAX_FAILURES = 3
+    
+    def __init__(self, url: str, dest: str, mirrors: Optional[List[str]] = None,
+                 checksum: Optional[str] = None, connections: int = 4, timeout: float = 15):
+        import hashlib
+        self.url = url
+        self.dest = dest
+        self.endpoints = [url] + [mirror for mirror in (mirrors or []) if mirror != url]
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.part_file = dest + ".part"
+        self.state_file = dest + ".part.json"
+        
+        self.algorithm, self.expected = None, None
+        if checksum:
+            self.algorithm, _, self.expected = checksum.partition(":")
+            if not self.expected:
+                self.algorithm, self.expected = "sha256", checksum
+            self.algorithm = self.algorithm.lower()
+            hashlib.new(self.algorithm)
+        
+        self._lock = threading.Lock()
+        self._hash_lock = threading.Lock()
+        self._hasher = None
+        self._hashed = 0
+    
+    def probe(self, endpoint: str) -> Dict:
+        """请求开头一小段数据，获取文件大小、是否支持Range、文件版本标识（ETag/Last-Modified）以及下载速度"""
+        result = {"endpoint": endpoint, "ok": False, "size": None, "ranges": False,
+                  "validator": None, "speed": 0.0, "error": None}
+        start = time.monotonic()
+        try:
+            with http_get(endpoint, headers={"Range": f"bytes=0-{self.PROBE_BYTES - 1}"},
+                          stream=True, timeout=self.timeout) as response:
+                if response.status_code == 206:
+                    match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+                    result["ranges"] = bool(match)
+                    result["size"] = int(match.group(1)) if match else None
+                elif response.status_code == 200:
+                    length = response.headers.get("Content-Length")
+                    result["size"] = int(length) if length and length.isdigit() else None
+                else:
+                    result["error"] = f"HTTP {response.status_code}"
+                    return result
+                etag, modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                result["validator"] = f"etag:{etag}" if etag else (f"modified:{modified}" if modified else None)
+                received = 0
+                for chunk in response.iter_content(chunk_size=65536):
+                    received += len(chunk)
+                    if received >= self.PROBE_BYTES:
+                        break
+        except Exception as e:
+            result["error"] = str(e) or e.__class__.__name__
+            return result
+        result["ok"] = True
+        result["speed"] = received / max(time.monotonic() - start, 1e-6)
+        return result
+    
+    def _load_state(self, size: int, segment_size: int, validator: Optional[str]) -> set:
+        """读取续传状态。地址、文件大小、分段大小或文件版本标识变化时重新下载；
+        服务端不提供ETag/Last-Modified时无法确认文件未变化，只在指定了校验值时续传
+        """
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if (state.get("url") != self.url or state.get("size") != size
+                or state.get("segment_size") != segment_size
+                or state.get("validator") != validator or not (validator or self.expected)
+                or not os.path.exists(self.part_file) or os.path.getsize(self.part_file) != size):
+            return set()
+        return set(state.get("done", []))
+    
+    def _save_state(self, size: int, segment_size: int, validator: Optional[str], done: set):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"url": self.url, "size": size, "segment_size": segment_size,
+                       "validator": validator, "done": sorted(done)}, f)
+        os.replace(tmp_file, self.state_file)
+    
+    def _advance_hash(self, fd: int, segments: List[Tuple[int, int]], done: set, blocking: bool = False):
+        """按顺序对已完成的连续分段做校验，读取的数据来自页缓存"""
+        if not self._hasher or not self._hash_lock.acquire(blocking):
+            return
+        try:
+            while True:
+                with self._lock:
+                    ready = self._hashed in done
+                if not ready:
+                    break
+                start, end = segments[self._hashed]
+                offset = start
+                while offset <= end:
+                    data = os.pread(fd, min(1024 * 1024, end - offset + 1), offset)
+                    if not data:
+                        raise OSError("读取已下载数据失败")
+                    self._hasher.update(data)
+                    offset += len(data)
+                self._hashed += 1
+        finally:
+            self._hash_lock.release()
+    
+    def _pick_endpoint(self, stats: Dict[str, Dict]) -> Optional[str]:
+        """按 速度/(进行中的分段数+1) 选择镜像，速度越快分到的分段越多"""
+        available = [endpoint for endpoint, stat in stats.items() if stat["failures"] < self.MAX_FAILURES]
+        if not available:
+            return None
+        return max(available, key=lambda endpoint: stats[endpoint]["speed"] / (stats[endpoint]["active"] + 1))
+    
+    def _download_segment(self, endpoint: str, fd: int, start: int, end: int):
+        with http_get(endpoint, headers={"Range": f"bytes={start}-{end}"},
+                      stream=True, timeout=self.timeout) as response:
+            if response.status_code != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-"):
+                raise OSError(f"HTTP {response.status_code}，不支持该Range请求")
+            offset = start
+            for chunk in response.iter_content(chunk_size=65536):
+                if offset + len(chunk) > end + 1:
+                    raise OSError("返回的数据超出请求范围")
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+            if offset != end + 1:
+                raise OSError(f"数据不完整: {offset - start}/{end - start + 1} 字节")
+    
+    def _download_single(self, endpoint: str):
+        """镜像不支持Range时退化为单连接下载，同样边下载边校验"""
+        print(f"⚠️  镜像不支持Range请求，使用单连接下载: {endpoint}")
+        with http_get(endpoint, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(self.part_file, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    if self._hasher:
+                        self._hasher.update(chunk)
+    
+    def download(self) -> str:
+        """执行下载，成功时返回目标文件路径，失败时抛出RuntimeError"""
+        import hashlib
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            probes = list(executor.map(self.probe, self.endpoints))
+        for probe in probes:
+            if probe["ok"]:
+                print(f"    • {probe['endpoint']}  {probe['speed'] / 1024:.0f}KB/s"
+                      f"{'' if probe['ranges'] else '  (不支持Range)'}")
+            else:
+                print(f"    • {probe['endpoint']}  不可用 ({(probe['error'] or '')[:80]})")
+        
+        working = sorted((probe for probe in probes if probe["ok"]), key=lambda probe: -probe["speed"])
+        if not working:
+            raise RuntimeError("所有下载地址均不可用")
+        
+        self._hasher = hashlib.new(self.algorithm) if self.algorithm else None
+        self._hashed = 0
+        
+        # 以主地址的文件大小为准（主地址不可用或不支持Range时取最快的支持Range的镜像），
+        # 只使用大小一致、支持Range的镜像
+        primary = probes[0]
+        reference = primary if primary["ok"] and primary["ranges"] else \
+            next((probe for probe in working if probe["ranges"]), None)
+        size = reference["size"] if reference else None
+        ranged = [probe for probe in working if probe["ranges"] and probe["size"] == size]
+        if not ranged:
+            self._download_single(working[0]["endpoint"])
+        else:
+            self._download_ranges(size, ranged, reference["validator"])
+        
+        if self._hasher:
+            actual = self._hasher.hexdigest()
+            if actual.lower() != self.expected.lower():
+                for path in (self.part_file, self.state_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise RuntimeError(f"{self.algorithm}校验失败: 期望 {self.expected}，实际 {actual}")
+            print(f"✅ {self.algorithm}校验通过: {actual}")
+        
+        os.replace(self.part_file, self.dest)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        return self.dest
+    
+    def _download_ranges(self, size: int, probes: List[Dict], validator: Optional[str]):
+        segment_size = max(self.MIN_SEGMENT, -(-size // (self.connections * 4)))
+        segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+        done = self._load_state(size, segment_size, validator)
+        if done:
+            print(f"🔁 续传: 已完成 {len(done)}/{len(segments)} 个分段")
+        elif os.path.exists(self.state_file):
+            print("⚠️  下载地址或服务端文件已变化，丢弃未完成的下载")
+        
+        # 预分配文件，各分段直接写入自己的偏移位置
+        fd = os.open(self.part_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+                if hasattr(os, "posix_fallocate") and size:
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError:
+                        pass
+            
+            pending = [index for index in range(len(segments)) if index not in done]
+            stats = {probe["endpoint"]: {"speed": probe["speed"], "active": 0, "failures": 0, "bytes": 0}
+                     for probe in probes}
+            errors = []
+            
+            def worker():
+                while True:
+                    with self._lock:
+                        if not pending or errors:
+                            return
+                        endpoint = self._pick_endpoint(stats)
+                        if endpoint is None:
+                            errors.append("所有镜像均多次失败")
+                            return
+                        index = pending.pop(0)
+                        stats[endpoint]["active"] += 1
+                    
+                    start, end = segments[index]
+                    began = time.monotonic()
+                    try:
+                        self._download_segment(endpoint, fd, start, end)
+                    except Exception as e:
+                        with self._lock:
+                            stats[endpoint]["active"] -= 1
+                            stats[endpoint]["failures"] += 1
+                            pending.insert(0, index)
+                            if errors:
+                                return
+                        print(f"    ⚠️  分段 {index} 从 {endpoint} 下载失败，将重试: {str(e)[:120]}")
+                        continue
+                    
+                    with self._lock:
+                        stat = stats[endpoint]
+                        stat["active"] -= 1
+                        stat["bytes"] += end - start + 1
+                        # 用指数滑动平均更新镜像速度
+                        speed = (end - start + 1) / max(time.monotonic() - began, 1e-6)
+                        stat["speed"] = 0.7 * stat["speed"] + 0.3 * speed
+                        done.add(index)
+                        self._save_state(size, segment_size, validator, done)
+                    self._advance_hash(fd, segments, done)
+            
+            started = time.monotonic()
+            threads = [threading.Thread(target=worker, daemon=True)
+                       for _ in range(min(self.connections, len(pending)))]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                # 已完成的分段记录在状态文件中，下次执行时续传
+                with self._lock:
+                    errors.append("已中断")
+                raise
+            if errors or len(done) != len(segments):
+                raise RuntimeError(f"下载未完成（{len(done)}/{len(segments)} 个分段），可重新执行以续传")
+            self._advance_hash(fd, segments, done, blocking=True)
+        finally:
+            os.close(fd)
+        
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"📥 下载完成: {size / 1024 / 1024:.1f}MB，{len(segments)} 个分段，"
+              f"平均 {sum(stat['bytes'] for stat in stats.values()) / 1024 / elapsed:.0f}KB/s")
+        for endpoint, stat in stats.items():
+            print(f"    • {endpoint}  {stat['bytes'] / 1024 / 1024:.1f}MB  失败 {stat['failures']} 次")
+
+
+def fetch(url: str, dest: Optional[str] = None, mirrors: Optional[List[str]] = None,
+          checksum: Optional[str] = None, connections: int = 4) -> str:
+    """分段下载URL到dest（默认取URL中的文件名），返回文件路径"""
+    dest = dest or os.path.basename(urlparse(url).path) or "download"
+    return SegmentedDownloader(url, dest, mirrors, checksum, connections).download()
+
+
+class ServerOptimizer:
+    def __init__(self, profile: Optional[Dict] = None):
+        import platform
         self.is_china = False
         self.ip_info = {}
         self.system = platform.system().lower()
-        
+        self.profile = profile or load_profile(DEFAULT_PROFILE)
+        self.ip_measurements = []
+        self.mirror_results = {}
+        self.git_benchmark = None
+        self.proxy_routes = {}
+        self.failed_steps = {}
+
     def get_public_ip(self) -> str:
         """获取公网IP地址"""
         try:
@@ -34,7 +1419,7 @@ class ServerOptimizer:
             
             for service in ip_services:
                 try:
-                    response = requests.get(service, timeout=5)
+                    response = http_get(service, timeout=5)
                     if response.status_code == 200:
                         return response.text.strip()
                 except:
@@ -50,7 +1435,7 @@ class ServerOptimizer:
         try:
             # 使用ip-api.com服务检测地理位置
             url = f"http://ip-api.com/json/{ip}?fields=country,countryCode,region,regionName,city,isp"
-            response = requests.get(url, timeout=10)
+            response = http_get(url, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -97,22 +1482,9 @@ class ServerOptimizer:
         """优化DNS设置"""
         print("\n🔧 优化DNS设置...")
         
-        if self.is_china:
-            # 国内DNS优化
-            dns_servers = [
-                "223.5.5.5",  # 阿里DNS
-                "119.29.29.29",  # 腾讯DNS
-                "114.114.114.114",  # 114DNS
-                "8.8.8.8"  # Google DNS作为备用
-            ]
-        else:
-            # 国外DNS优化
-            dns_servers = [
-                "8.8.8.8",  # Google DNS
-                "8.8.4.4",  # Google DNS备用
-                "1.1.1.1",  # Cloudflare DNS
-                "1.0.0.1"   # Cloudflare DNS备用
-            ]
+        # DNS服务器列表由优化配置决定
+        dns_config = self.profile.get("dns", {})
+        dns_servers = dns_config.get("china" if self.is_china else "overseas", [])
         
         # Linux系统DNS优化
         for i, dns in enumerate(dns_servers):
@@ -400,30 +1772,207 @@ class ServerOptimizer:
         for host_entry in gitee_hosts:
             self.run_command(f"echo '{host_entry}' >> {hosts_file}", f"添加Gitee hosts: {host_entry}")
         
-        # 如果是在国内，还可以配置Git使用Gitee作为备用源
-        if self.is_china:
-            print("🔧 配置Git使用Gitee作为备用源...")
-            self.run_command("git config --global url.'https://gitee.com/'.insteadOf 'https://github.com/'", "配置Git使用Gitee镜像")
-            self.run_command("git config --global url.'https://gitee.com/'.insteadOf 'git@github.com:'", "配置Git SSH使用Gitee镜像")
+        # 旧版本会把所有GitHub地址改写到gitee.com，未镜像的仓库会因此无法克隆
+        # 这里移除该全局改写，只对已确认存在镜像的仓库改写（见 optimize_git）
+        if self.run_command("git config --global --get-all url.https://gitee.com/.insteadOf", "检查Git全局改写", silent=True):
+            self.run_command("git config --global --unset-all url.https://gitee.com/.insteadOf", "移除Git全局Gitee改写")
+    
+    def git_config_get(self, key: str) -> Optional[str]:
+        """读取Git全局配置，不存在时返回None"""
+        result = subprocess.run(["git", "config", "--global", "--get", key],
+                                capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+    
+    def git_include(self, path: str):
+        """在全局gitconfig中引用改写规则文件（已引用时不重复添加）"""
+        result = subprocess.run(["git", "config", "--global", "--get-all", "include.path"],
+                                capture_output=True, text=True)
+        if path not in result.stdout.splitlines():
+            self.run_command(f"git config --global --add include.path {shlex.quote(path)}",
+                             f"引用改写规则 {path}")
+    
+    def measure_clone(self, url: str, attempts: int = 1, timeout: float = 600) -> Optional[float]:
+        """克隆参考仓库并返回耗时中位数（秒），失败时返回None"""
+        import statistics
+        import tempfile
+        durations = []
+        for _ in range(attempts):
+            workdir = tempfile.mkdtemp(prefix="server_optimizer_clone_")
+            try:
+                start = time.monotonic()
+                # --no-local 避免本地路径使用硬链接，使测量结果与网络克隆一致
+                result = subprocess.run(
+                    ["git", "clone", "--quiet", "--no-local", url, os.path.join(workdir, "repo")],
+                    capture_output=True, text=True, timeout=timeout
+                )
+                if result.returncode == 0:
+                    durations.append(time.monotonic() - start)
+                else:
+                    print(f"    ⚠️  克隆失败: {result.stderr.strip()[:200]}")
+            except subprocess.TimeoutExpired:
+                print(f"    ⚠️  克隆超时（{timeout}秒）")
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        return statistics.median(durations) if durations else None
+    
+    def find_mirrored_repos(self, mirrored_repos: Dict[str, str]) -> Dict[str, str]:
+        """用 git ls-remote 确认镜像仓库确实存在，返回可用的 上游 -> 镜像"""
+        from concurrent.futures import ThreadPoolExecutor
+        def check(item):
+            upstream, mirror = item
+            try:
+                result = subprocess.run(["git", "ls-remote", "--heads", mirror],
+                                        capture_output=True, text=True, timeout=20,
+                                        env=dict(os.environ, GIT_TERMINAL_PROMPT="0"))
+                return upstream, mirror, result.returncode == 0
+            except subprocess.TimeoutExpired:
+                return upstream, mirror, False
+        
+        available = {}
+        with ThreadPoolExecutor(max_workers=min(8, max(1, len(mirrored_repos)))) as executor:
+            for upstream, mirror, ok in executor.map(check, mirrored_repos.items()):
+                print(f"    {'✅' if ok else '❌'} {upstream} -> {mirror}")
+                if ok:
+                    available[upstream] = mirror
+        return available
+    
+    def optimize_git(self):
+        """设置Git传输相关的吞吐量参数，并只为已确认存在镜像的仓库配置改写"""
+        print("\n🔧 优化Git传输设置...")
+        
+        if not shutil.which("git"):
+            print("⚠️  未安装git，跳过")
+            return
+        
+        config = self.profile.get("git", {})
+        benchmark = config.get("benchmark_repo") if config.get("benchmark") else None
+        attempts = config.get("benchmark_attempts", 1)
+        
+        before = None
+        if benchmark:
+            print(f"⏱️  优化前克隆参考仓库: {benchmark}")
+            before = self.measure_clone(benchmark, attempts)
+        
+        # 记录原值，以便 --revert git 恢复（只记录第一次修改前的值）
+        state = load_state("git")
+        previous = state.setdefault("config", {})
+        for key, value in config.get("config", {}).items():
+            if key not in previous:
+                previous[key] = self.git_config_get(key)
+            self.run_command(f"git config --global {key} {shlex.quote(str(value))}", f"设置 {key}={value}")
+        
+        # 按仓库改写到镜像：<url> 与 <url>.git 两种写法都精确改写，不误匹配同前缀的其他仓库
+        mirrored_repos = config.get("mirrored_repos", {}) if self.is_china else {}
+        if mirrored_repos:
+            print("🔍 检查镜像仓库是否存在...")
+            mirrors = state.setdefault("mirrors", {})
+            for upstream, mirror in self.find_mirrored_repos(mirrored_repos).items():
+                mirror_url = re.sub(r"\.git$", "", mirror.rstrip("/"))
+                mirrors[re.sub(r"\.git$", "", upstream.rstrip("/"))] = mirror_url
+                print(f"    📝 改写 {upstream} -> {mirror_url}")
+            if mirrors:
+                # 规则集中写在状态目录的一个文件中，全局gitconfig只增加一行 include.path
+                rules_file = os.path.join(STATE_DIR, "git_rewrites.gitconfig")
+                rules = []
+                for upstream, mirror_url in mirrors.items():
+                    rules += exact_insteadof_rules(upstream, mirror_url, mirror_url + ".git")
+                write_gitconfig_rules(rules_file, rules, "由 server_optimizer git 生成，请勿手动修改")
+                self.git_include(rules_file)
+                state["include"] = rules_file
+        save_state("git", state)
+        
+        if benchmark:
+            print(f"⏱️  优化后克隆参考仓库: {benchmark}")
+            after = self.measure_clone(benchmark, attempts)
+            self.git_benchmark = (before, after)
+            if before is None or after is None:
+                print("⚠️  克隆测量失败，无法确认优化效果")
+            elif after <= before:
+                print(f"✅ 克隆耗时 {before:.2f}s -> {after:.2f}s，提升 {(1 - after / before):.0%}")
+            else:
+                print(f"⚠️  克隆耗时 {before:.2f}s -> {after:.2f}s，未见提升，"
+                      "可使用 --revert git 恢复原有设置")
+    
+    def revert_git(self):
+        """恢复Git全局配置到优化前的值"""
+        print("\n🔄 恢复Git配置...")
+        state = load_state("git")
+        if not state:
+            print("✅ 未发现Git配置的修改记录，无需恢复")
+            return
+        
+        for key, value in state.get("config", {}).items():
+            if value is None:
+                self.run_command(f"git config --global --unset-all {key}", f"移除 {key}")
+            else:
+                self.run_command(f"git config --global {key} {shlex.quote(value)}", f"恢复 {key}={value}")
+        if state.get("include"):
+            pattern = git_value_pattern(state["include"])
+            self.run_command(f"git config --global --unset include.path {shlex.quote(pattern)}",
+                             f"移除镜像仓库改写 {state['include']}")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(state["include"])
+        save_state("git", None)
+    
+    def optimize_git_cache(self):
+        """配置本地git镜像缓存：预热常用仓库、定时增量更新，可选通过insteadOf透明使用"""
+        print("\n📂 配置本地git镜像缓存...")
+        
+        if not shutil.which("git"):
+            print("⚠️  未安装git，跳过")
+            return
+        
+        config = self.profile.get("git_cache", {})
+        cache = GitMirrorCache.from_profile(self.profile)
+        os.makedirs(cache.cache_dir, exist_ok=True)
+        print(f"📁 缓存目录: {cache.cache_dir}（上限 {cache.max_size / 1024 / 1024:.0f}MB）")
+        
+        # 定时在后台增量更新所有镜像
+        minutes = min(59, max(1, cache.refresh_interval // 60))
+        cron_line = (f"*/{minutes} * * * * root {sys.executable} {os.path.abspath(__file__)} "
+                     f"git-cache --cache-dir {shlex.quote(cache.cache_dir)} refresh >/dev/null 2>&1")
+        if update_managed_block(GIT_CACHE_CRON_FILE, "git_cache", [cron_line]):
+            print(f"✅ 已写入定时更新任务: {GIT_CACHE_CRON_FILE}（每{minutes}分钟）")
+        
+        for url in config.get("repos", []):
+            try:
+                path, hit = cache.ensure(url)
+            except (RuntimeError, ValueError) as e:
+                print(f"❌ 预热 {url} 失败: {e}")
+                continue
+            print(f"{'✅ 已缓存' if hit else '📥 已创建镜像'}: {url}")
+            if config.get("insteadof"):
+                cache.enable_insteadof(url)
+        
+        if config.get("insteadof"):
+            # 改写规则集中在缓存目录的一个文件中，全局gitconfig只增加一行 include.path
+            self.git_include(cache.insteadof_file)
+            save_state("git_cache", {"include": cache.insteadof_file})
+            print(f"⚠️  透明模式下直接 git clone 得到的是镜像的快照，最多落后上游 {cache.refresh_interval} 秒；"
+                  "需要最新提交（如CI构建刚推送的代码）时请使用 git-cache clone")
+        
+        print("💡 使用缓存克隆（复用本地对象并从上游获取增量）: "
+              "python3 server_optimizer.py git-cache clone <url> [目录]")
+    
+    def revert_git_cache(self):
+        """移除镜像缓存的定时任务和insteadOf改写（缓存目录保留）"""
+        print("\n🔄 恢复git镜像缓存配置...")
+        changed = update_managed_block(GIT_CACHE_CRON_FILE, "git_cache", [])
+        include = load_state("git_cache").get("include")
+        if include:
+            pattern = git_value_pattern(include)
+            self.run_command(f"git config --global --unset include.path {shlex.quote(pattern)}",
+                             f"移除改写规则引用 {include}")
+            GitMirrorCache(os.path.dirname(include)).disable_insteadof()
+            changed = True
+        save_state("git_cache", None)
+        print("✅ 已移除git镜像缓存配置" if changed else "✅ 未发现git镜像缓存配置，无需恢复")
     
     def optimize_docker(self):
         """优化Docker镜像源"""
         print("\n🐳 优化Docker镜像源...")
         
-        docker_mirrors = [
-            "https://docker.m.daocloud.io",
-            "https://docker.1panel.live",
-            "https://hub.rat.dev"
-        ]
-        
-        docker_daemon_config = {
-            "registry-mirrors": docker_mirrors,
-            "log-driver": "json-file",
-            "log-opts": {
-                "max-size": "10m",
-                "max-file": "3"
-            }
-        }
+        docker_daemon_config = self.profile.get("docker", {})
         
         config_dir = "/etc/docker"
         config_file = f"{config_dir}/daemon.json"
@@ -446,36 +1995,567 @@ class ServerOptimizer:
         """网络优化设置"""
         print("\n🌐 网络优化设置...")
         
-        # Linux网络优化
-        optimizations = [
-            # TCP优化
-            "echo 'net.core.rmem_max = 16777216' >> /etc/sysctl.conf",
-            "echo 'net.core.wmem_max = 16777216' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_rmem = 4096 87380 16777216' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_wmem = 4096 65536 16777216' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_congestion_control = bbr' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_window_scaling = 1' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_timestamps = 1' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_sack = 1' >> /etc/sysctl.conf",
-            # 连接优化
-            "echo 'net.core.netdev_max_backlog = 5000' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_max_syn_backlog = 8192' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_max_tw_buckets = 2000000' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_tw_reuse = 1' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_fin_timeout = 30' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_keepalive_time = 1200' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_keepalive_intvl = 15' >> /etc/sysctl.conf",
-            "echo 'net.ipv4.tcp_keepalive_probes = 5' >> /etc/sysctl.conf"
-        ]
+        # Linux网络优化，参数由优化配置决定，整体写入一个配置块，切换配置时替换上一次写入的参数
+        sysctl = {key: value for key, value in self.profile.get("sysctl", {}).items() if value is not None}
+        previous = [line.split("=", 1)[0].strip()
+                    for line in read_managed_block(SYSCTL_CONF_FILE, "network") if "=" in line]
+        if update_managed_block(SYSCTL_CONF_FILE, "network", [f"{key} = {value}" for key, value in sysctl.items()]):
+            print(f"✅ 已将 {len(sysctl)} 项网络优化参数写入 {SYSCTL_CONF_FILE}")
+        else:
+            print(f"✅ {SYSCTL_CONF_FILE} 中的网络优化参数已是最新")
         
-        for opt in optimizations:
-            self.run_command(opt, "应用网络优化参数")
+        # 之前的配置设置过、当前配置不再设置的参数恢复为内核默认值
+        for key in previous:
+            if key not in sysctl and key in KERNEL_SYSCTL_DEFAULTS:
+                assignment = shlex.quote(f"{key}={KERNEL_SYSCTL_DEFAULTS[key]}")
+                self.run_command(f"sysctl -w {assignment}", f"恢复内核默认值 {key}")
         
         # 应用sysctl配置
-        self.run_command("sysctl -p", "应用系统参数")
+        self.run_command(f"sysctl -p {shlex.quote(SYSCTL_CONF_FILE)}", "应用系统参数")
+    
+    def get_ip_preference_endpoints(self) -> Tuple[List[str], List[str]]:
+        """返回需要测量的端点列表，以及其中Docker使用的端点"""
+        config = self.profile.get("ip_preference", {})
+        docker_endpoints = list(config.get("docker_endpoints", []))
+        for mirror in self.profile.get("docker", {}).get("registry-mirrors", []):
+            host = urlparse(mirror).hostname
+            if host and host not in docker_endpoints:
+                docker_endpoints.append(host)
+        endpoints = list(config.get("endpoints", []))
+        endpoints += [host for host in docker_endpoints if host not in endpoints]
+        return endpoints, docker_endpoints
+    
+    def measure_ip_preference(self, endpoints: List[str]) -> List[Dict]:
+        """并发测量每个端点的IPv4/IPv6建连成功率与延迟，并给出选择"""
+        from concurrent.futures import ThreadPoolExecutor
+        config = self.profile.get("ip_preference", {})
+        port = config.get("port", 443)
+        attempts = config.get("attempts", 3)
+        timeout = config.get("timeout", 3)
+        margin_ms = config.get("margin_ms", 50)
+        
+        def measure(endpoint):
+            host, host_port = _split_endpoint(endpoint, port)
+            v4 = measure_connect(host, socket.AF_INET, host_port, attempts, timeout)
+            v6 = measure_connect(host, socket.AF_INET6, host_port, attempts, timeout)
+            choice, reason = choose_ip_family(v4, v6, margin_ms)
+            return {"endpoint": endpoint, "host": host, "ipv4": v4, "ipv6": v6,
+                    "choice": choice, "reason": reason}
+        
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(endpoints)))) as executor:
+            return list(executor.map(measure, endpoints))
+    
+    def print_ip_measurements(self, measurements: List[Dict]):
+        """打印IPv4/IPv6测量结果及每个选择的依据"""
+        def describe(result):
+            if not result["address"]:
+                return "无记录"
+            latency = f"{result['latency_ms']:.0f}ms" if result["latency_ms"] is not None else "超时"
+            return f"{result['success_rate']:.0%} {latency}"
+        
+        print(f"    {'端点':<32} {'IPv4':<14} {'IPv6':<14} 选择")
+        for item in measurements:
+            print(f"    {item['endpoint']:<32} {describe(item['ipv4']):<14} {describe(item['ipv6']):<14} "
+                  f"{item['choice']}（{item['reason']}）")
+    
+    def optimize_ip_preference(self):
+        """测量IPv4/IPv6路径质量，按实测结果设置地址族优先级"""
+        print("\n🔀 测量IPv4/IPv6路径质量...")
+        
+        endpoints, docker_endpoints = self.get_ip_preference_endpoints()
+        
+        # 已在hosts中固定地址的主机（如github步骤写入的IPv4地址）不经过DNS解析，
+        # 测量结果只反映固定的地址，写入另一族记录也无法过滤掉它，因此跳过
+        pinned = read_pinned_hosts(HOSTS_FILE, "ip_preference")
+        skipped = [e for e in endpoints if _split_endpoint(e, 0)[0].lower() in pinned]
+        if skipped:
+            print(f"⏭️  以下端点已在 {HOSTS_FILE} 中固定地址，跳过测量:")
+            for endpoint in skipped:
+                print(f"    • {endpoint} -> {pinned[_split_endpoint(endpoint, 0)[0].lower()]}")
+            endpoints = [e for e in endpoints if e not in skipped]
+        
+        if not endpoints:
+            print("⚠️  没有需要测量的端点，跳过")
+            # 清除之前运行写入的配置块，避免遗留过期的优先级设置
+            self.apply_ip_preference([], [])
+            return
+        
+        self.ip_measurements = self.measure_ip_preference(endpoints)
+        self.print_ip_measurements(self.ip_measurements)
+        
+        # 只统计同时拥有A和AAAA记录的端点
+        dual_stack = [m for m in self.ip_measurements if m["ipv4"]["address"] and m["ipv6"]["address"]]
+        prefer_v4 = [m for m in dual_stack if m["choice"] == "ipv4"]
+        
+        # 多数双栈端点的IPv6路径较差时，通过gai.conf全局优先IPv4
+        global_v4 = bool(dual_stack) and len(prefer_v4) * 2 >= len(dual_stack)
+        if global_v4:
+            print(f"📝 {len(prefer_v4)}/{len(dual_stack)} 个双栈端点IPv6较差，在 {GAI_CONF_FILE} 中设置IPv4优先")
+        
+        # 其余端点在hosts中固定为所选地址族（过滤掉另一族记录）
+        # Docker守护进程（Go解析器）不读取gai.conf，因此Docker端点总是写入hosts
+        hosts_lines = []
+        for m in self.ip_measurements:
+            if m["choice"] == "any":
+                continue
+            if global_v4 and m["choice"] == "ipv4" and m["host"] not in docker_endpoints:
+                continue
+            family = "ipv4" if m["choice"] == "ipv4" else "ipv6"
+            hosts_lines.append(f"{m[family]['address']} {m['host']}  # {m['reason']}")
+        
+        if hosts_lines:
+            print(f"📝 在 {HOSTS_FILE} 中为 {len(hosts_lines)} 个端点固定地址族")
+        changed = self.apply_ip_preference(GAI_PREFER_IPV4 if global_v4 else [], hosts_lines)
+        if changed is None:
+            return
+        if changed or global_v4:
+            print("✅ IPv4/IPv6优先级配置完成，可使用 --revert ip_preference 恢复")
+        else:
+            print("✅ IPv4/IPv6路径相当，无需调整")
+    
+    def apply_ip_preference(self, gai_lines: List[str], hosts_lines: List[str]) -> Optional[bool]:
+        """写入（内容为空时清除）gai.conf和hosts中的配置块，返回是否有修改，无法写入时返回None"""
+        try:
+            changed = update_managed_block(GAI_CONF_FILE, "ip_preference", gai_lines)
+            return update_managed_block(HOSTS_FILE, "ip_preference", hosts_lines) or changed
+        except OSError as e:
+            print(f"❌ 无法写入IPv4/IPv6优先级配置（需要root权限）: {e}")
+            return None
+    
+    def revert_ip_preference(self):
+        """移除IPv4/IPv6优先级配置"""
+        print("\n🔄 恢复IPv4/IPv6优先级配置...")
+        changed = self.apply_ip_preference([], [])
+        if changed is not None:
+            print("✅ 已移除IPv4/IPv6优先级配置" if changed else "✅ 未发现IPv4/IPv6优先级配置，无需恢复")
+    
+    def backup_for_rollback(self, step: str, path: str):
+        """修改文件前备份，并记录到回滚状态（同一文件只记录第一次的原始内容）"""
+        state = load_state(step)
+        entries = state.setdefault("files", [])
+        if any(entry["path"] == path for entry in entries):
+            return
+        backup = None
+        if os.path.exists(path):
+            backup = f"{path}.backup.{int(time.time())}"
+            shutil.copy2(path, backup)
+        entries.append({"path": path, "backup": backup})
+        save_state(step, state)
+    
+    def restore_rollback(self, step: str) -> int:
+        """按回滚状态恢复文件，返回恢复的文件数"""
+        restored = 0
+        for entry in load_state(step).get("files", []):
+            path, backup = entry["path"], entry["backup"]
+            try:
+                if backup:
+                    shutil.copy2(backup, path)
+                elif os.path.exists(path):
+                    os.remove(path)
+                print(f"    ✅ 已恢复 {path}")
+                restored += 1
+            except OSError as e:
+                print(f"    ❌ 恢复 {path} 失败: {e}")
+        save_state(step, None)
+        return restored
+    
+    def get_package_mirror_targets(self) -> List[Dict]:
+        """根据系统中已安装的包管理器，返回需要选择镜像的生态及其候选镜像"""
+        config = self.profile.get("package_mirrors", {})
+        os_release = read_os_release()
+        distro = os_release.get("ID", "")
+        fields = {
+            "codename": os_release.get("VERSION_CODENAME", ""),
+            "version": os_release.get("VERSION_ID", "").split(".")[0],
+        }
+        tools = {"pip": ["pip3", "pip"], "apt": ["apt-get"], "yum": ["dnf", "yum"], "npm": ["npm"]}
+        
+        targets = []
+        for ecosystem in config.get("ecosystems", []):
+            settings = config.get(ecosystem, {})
+            if ecosystem in ("apt", "yum"):
+                # 系统软件源按发行版区分
+                settings = settings.get(distro)
+            if not settings or not settings.get("candidates"):
+                continue
+            if not any(shutil.which(tool) for tool in tools.get(ecosystem, [ecosystem])):
+                continue
+            probe_path = settings.get("probe_path", "").format(**fields)
+            targets.append({
+                "ecosystem": ecosystem,
+                "settings": settings,
+                "candidates": settings["candidates"],
+                "probe_urls": [f"{url.rstrip('/')}/{probe_path}" for url in settings["candidates"]],
+            })
+        return targets
+    
+    def probe_package_mirrors(self, targets: List[Dict]) -> Dict[str, List[Dict]]:
+        """并发探测所有候选镜像，返回 生态 -> 按速度排序的结果"""
+        from concurrent.futures import ThreadPoolExecutor
+        timeout = self.profile.get("package_mirrors", {}).get("timeout", 5)
+        jobs = [(target["ecosystem"], mirror, probe_url)
+                for target in targets
+                for mirror, probe_url in zip(target["candidates"], target["probe_urls"])]
+        
+        def probe(job):
+            ecosystem, mirror, probe_url = job
+            result = probe_mirror(probe_url, timeout)
+            result["mirror"] = mirror
+            return ecosystem, result
+        
+        results = {target["ecosystem"]: [] for target in targets}
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(jobs)))) as executor:
+            for ecosystem, result in executor.map(probe, jobs):
+                results[ecosystem].append(result)
+        return {ecosystem: rank_mirrors(items) for ecosystem, items in results.items()}
+    
+    def print_mirror_results(self, ecosystem: str, results: List[Dict]):
+        """打印某个生态的镜像探测结果"""
+        print(f"  📦 {ecosystem}:")
+        for result in results:
+            if result["ok"]:
+                print(f"    • {result['mirror']:<48} 延迟 {result['latency_ms']:.0f}ms  "
+                      f"吞吐 {result['throughput_kbps']:.0f}KB/s  总耗时 {result['total_ms']:.0f}ms")
+            else:
+                print(f"    • {result['mirror']:<48} 不可用 ({result['error'][:80]})")
+    
+    @staticmethod
+    def is_candidate_mirror(value: str, candidates: List[str]) -> bool:
+        return value.rstrip("/") in [candidate.rstrip("/") for candidate in candidates]
+    
+    def apply_pip_mirror(self, settings: Dict, mirror: str) -> Optional[bool]:
+        """写入pip.conf的index-url，自定义的源（如内部私有源）保持不变时返回None"""
+        import configparser
+        config_file = os.path.expanduser(settings.get("config_file", "/etc/pip.conf"))
+        # 与pip一致使用RawConfigParser，URL中的%编码不会被当作插值语法
+        parser = configparser.RawConfigParser()
+        try:
+            parser.read(config_file, encoding='utf-8')
+        except configparser.Error as e:
+            print(f"    ⚠️  无法解析 {config_file}，保持不变: {str(e).splitlines()[0]}")
+            return None
+        
+        # 未配置index-url时pip使用官方源（候选列表第一项）
+        current = parser.get("global", "index-url", fallback=settings["candidates"][0])
+        if not self.is_candidate_mirror(current, settings["candidates"]):
+            print(f"    ⏭️  {config_file} 中的index-url指向自定义的源 {urlparse(current).hostname}，保持不变")
+            return None
+        if current.rstrip("/") == mirror.rstrip("/"):
+            return False
+        
+        if not parser.has_section("global"):
+            parser.add_section("global")
+        parser.set("global", "index-url", mirror)
+        host = urlparse(mirror).hostname
+        if urlparse(mirror).scheme == "http" and host:
+            parser.set("global", "trusted-host", host)
+        else:
+            parser.remove_option("global", "trusted-host")
+        
+        self.backup_for_rollback("package_mirrors", config_file)
+        os.makedirs(os.path.dirname(config_file) or ".", exist_ok=True)
+        with open(config_file, 'w', encoding='utf-8') as f:
+            parser.write(f)
+        return True
+    
+    def apply_npm_mirror(self, settings: Dict, mirror: str) -> Optional[bool]:
+        """写入.npmrc的registry，自定义的registry（如内部私有源）保持不变时返回None"""
+        config_file = os.path.expanduser(settings.get("config_file", "~/.npmrc"))
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            lines = []
+        
+        current = [line.split("=", 1)[1].strip() for line in lines if line.strip().startswith("registry=")]
+        # 未配置registry时npm使用官方源（候选列表第一项）
+        current = current[-1] if current else settings["candidates"][0]
+        if not self.is_candidate_mirror(current, settings["candidates"]):
+            print(f"    ⏭️  {config_file} 中的registry指向自定义的源 {urlparse(current).hostname}，保持不变")
+            return None
+        if current.rstrip("/") == mirror.rstrip("/"):
+            return False
+        
+        updated = [line for line in lines if not line.strip().startswith("registry=")]
+        updated.append(f"registry={mirror}")
+        
+        self.backup_for_rollback("package_mirrors", config_file)
+        with open(config_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(updated) + "\n")
+        return True
+    
+    def apply_repo_mirror(self, ecosystem: str, settings: Dict, mirror: str) -> bool:
+        """将apt sources或yum repo文件中的上游/其他镜像地址替换为选中的镜像"""
+        import glob
+        candidates = settings["candidates"]
+        # 官方源最快时只替换之前写入的镜像地址，保留系统默认的mirrorlist等配置
+        bases = [url for url in candidates if url != mirror]
+        if mirror != candidates[0]:
+            bases += settings.get("upstream", [])
+        
+        files = []
+        for pattern in settings.get("files", []):
+            files += sorted(glob.glob(pattern))
+        
+        changed = False
+        for path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            
+            # 只处理包含上游或其他候选镜像地址的文件
+            if not any(base in content for base in bases):
+                continue
+            
+            lines = []
+            for line in content.splitlines():
+                if ecosystem == "yum" and line.startswith(("mirrorlist=", "metalink=")):
+                    if mirror != candidates[0]:
+                        line = "#" + line
+                elif any(base in line for base in bases):
+                    for base in bases:
+                        line = line.replace(base, mirror)
+                    if ecosystem == "yum":
+                        line = re.sub(r"^#\s*baseurl=", "baseurl=", line)
+                lines.append(line)
+            updated = "\n".join(lines) + ("\n" if content.endswith("\n") else "")
+            if updated == content:
+                continue
+            
+            self.backup_for_rollback("package_mirrors", path)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(updated)
+            print(f"    📝 已更新 {path}")
+            changed = True
+        return changed
+    
+    def optimize_package_mirrors(self):
+        """为pip、apt/yum、npm选择延迟最低、速度最快的镜像源"""
+        print("\n📦 选择软件包镜像源...")
+        
+        targets = self.get_package_mirror_targets()
+        if not targets:
+            print("⚠️  未检测到需要配置镜像的包管理器，跳过")
+            return
+        
+        self.mirror_results = self.probe_package_mirrors(targets)
+        for target in targets:
+            ecosystem, settings = target["ecosystem"], target["settings"]
+            results = self.mirror_results[ecosystem]
+            self.print_mirror_results(ecosystem, results)
+            
+            best = results[0] if results and results[0]["ok"] else None
+            if not best:
+                print(f"    ❌ {ecosystem} 没有可用的镜像，保持现有配置")
+                continue
+            
+            try:
+                if ecosystem == "pip":
+                    changed = self.apply_pip_mirror(settings, best["mirror"])
+                elif ecosystem == "npm":
+                    changed = self.apply_npm_mirror(settings, best["mirror"])
+                else:
+                    changed = self.apply_repo_mirror(ecosystem, settings, best["mirror"])
+            except OSError as e:
+                print(f"    ❌ 写入 {ecosystem} 镜像配置失败: {e}")
+                continue
+            
+            if changed is None:
+                continue
+            if changed:
+                print(f"    ✅ {ecosystem} 已切换到最快的镜像: {best['mirror']}")
+            else:
+                print(f"    ✅ {ecosystem} 当前配置已是最快的镜像: {best['mirror']}")
+        
+        if load_state("package_mirrors"):
+            print("💡 可使用 --revert package_mirrors 恢复原有配置")
+    
+    def revert_package_mirrors(self):
+        """恢复修改前的软件包镜像配置"""
+        print("\n🔄 恢复软件包镜像配置...")
+        if not self.restore_rollback("package_mirrors"):
+            print("✅ 未发现软件包镜像配置的修改记录，无需恢复")
+    
+    def get_proxy_candidates(self) -> List[str]:
+        return list(self.profile.get("proxy_routing", {}).get("proxies", []))
+    
+    def measure_proxy_routes(self, targets: Dict[str, str], proxies: List[str]) -> Dict[str, List[Dict]]:
+        """并发测量每个域名经由直连和各个代理的表现，返回 域名 -> 按总耗时排序的结果"""
+        import statistics
+        from concurrent.futures import ThreadPoolExecutor
+        config = self.profile.get("proxy_routing", {})
+        attempts = config.get("attempts", 2)
+        timeout = config.get("timeout", 5)
+        max_bytes = config.get("max_bytes", 1024 * 1024)
+        jobs = [(domain, url, proxy) for domain, url in targets.items() for proxy in [None] + proxies]
+        
+        def measure(job):
+            domain, url, proxy = job
+            samples = [measure_route(url, proxy, timeout, max_bytes) for _ in range(attempts)]
+            succeeded = [sample for sample in samples if sample["ok"]]
+            if not succeeded:
+                return domain, samples[-1]
+            best = dict(min(succeeded, key=lambda sample: sample["total_ms"]))
+            best["total_ms"] = round(statistics.median(sample["total_ms"] for sample in succeeded), 1)
+            best["success_rate"] = len(succeeded) / attempts
+            return domain, best
+        
+        routes = {domain: [] for domain in targets}
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(jobs)))) as executor:
+            for domain, result in executor.map(measure, jobs):
+                routes[domain].append(result)
+        return {domain: rank_mirrors(results) for domain, results in routes.items()}
+    
+    def choose_proxy_route(self, results: List[Dict]) -> Tuple[Optional[str], str]:
+        """选择路由：直连可用且不比最快代理慢 margin_ms 以上时走直连"""
+        margin_ms = self.profile.get("proxy_routing", {}).get("margin_ms", 50)
+        working = [result for result in results if result["ok"]]
+        if not working:
+            return None, "所有路由均不可用，保持直连"
+        direct = next((result for result in working if result["proxy"] is None), None)
+        best = working[0]
+        if direct and (best["proxy"] is None or direct["total_ms"] <= best["total_ms"] + margin_ms):
+            return None, f"直连最快 ({direct['total_ms']:.0f}ms)"
+        if not direct:
+            return best["proxy"], f"直连不可用，代理 {best['total_ms']:.0f}ms"
+        return best["proxy"], f"代理 {best['total_ms']:.0f}ms < 直连 {direct['total_ms']:.0f}ms"
+    
+    def print_proxy_routes(self, routes: Dict[str, List[Dict]]):
+        """打印每个域名的路由测量结果"""
+        for domain, results in routes.items():
+            print(f"  🌐 {domain}:")
+            for result in results:
+                name = result["proxy"] or "直连"
+                if result["ok"]:
+                    print(f"    • {name:<36} 建连 {result['connect_ms']:.0f}ms  首字节 {result['ttfb_ms']:.0f}ms  "
+                          f"吞吐 {result['throughput_kbps']:.0f}KB/s  总耗时 {result['total_ms']:.0f}ms")
+                else:
+                    print(f"    • {name:<36} 不可用 ({(result['error'] or '')[:80]})")
+    
+    def write_generated_file(self, step: str, path: str, content: str):
+        """写入生成的配置文件，并记录回滚信息"""
+        self.backup_for_rollback(step, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f"    📝 已写入 {path}")
+    
+    def optimize_proxy_routing(self):
+        """测量候选代理到各域名的速度，生成按域名的代理路由"""
+        print("\n🧭 配置按域名的代理路由...")
+        
+        proxies = self.get_proxy_candidates()
+        if not proxies:
+            print("⚠️  未配置候选代理（proxy_routing.proxies 或 --proxy），跳过")
+            return
+        
+        config = self.profile.get("proxy_routing", {})
+        targets = config.get("targets", {})
+        routes = self.measure_proxy_routes(targets, proxies)
+        self.print_proxy_routes(routes)
+        
+        self.proxy_routes = {domain: self.choose_proxy_route(results) for domain, results in routes.items()}
+        print("📋 路由选择:")
+        for domain, (proxy, reason) in self.proxy_routes.items():
+            print(f"    • {domain:<36} -> {proxy or '直连'}（{reason}）")
+        
+        direct = [domain for domain, (proxy, _) in self.proxy_routes.items() if not proxy]
+        proxied = {domain: proxy for domain, (proxy, _) in self.proxy_routes.items() if proxy}
+        
+        # 1. PAC文件
+        pac_lines = ["function FindProxyForURL(url, host) {"]
+        for domain, proxy in proxied.items():
+            pac_lines.append(f'    if (host == "{domain}" || dnsDomainIs(host, ".{domain}")) return "{pac_proxy_directive(proxy)}";')
+        pac_lines += ['    return "DIRECT";', "}"]
+        self.write_generated_file("proxy_routing", config.get("pac_file", "/etc/server_optimizer/proxy.pac"),
+                                  "\n".join(pac_lines) + "\n")
+        
+        # 2. 环境变量文件：代理取使用最多的一个，直连域名写入no_proxy
+        main_proxy = max(set(proxied.values()), key=list(proxied.values()).count) if proxied else None
+        no_proxy = ",".join(["localhost", "127.0.0.1", "::1"] + direct)
+        env_lines = [f"no_proxy={no_proxy}", f"NO_PROXY={no_proxy}"]
+        if main_proxy:
+            env_lines = [f"http_proxy={main_proxy}", f"https_proxy={main_proxy}",
+                         f"HTTP_PROXY={main_proxy}", f"HTTPS_PROXY={main_proxy}"] + env_lines
+        self.write_generated_file("proxy_routing", config.get("env_file", "/etc/server_optimizer/proxy.env"),
+                                  "\n".join(env_lines) + "\n")
+        
+        # 3. Git按URL设置代理，直连域名设置为空以覆盖全局http.proxy
+        # 记录原值，以便 --revert proxy_routing 恢复（只记录第一次修改前的值）
+        recorded = load_state("proxy_routing").get("git_config", {})
+        previous = {}
+        if shutil.which("git"):
+            for domain, (proxy, _) in self.proxy_routes.items():
+                key = f"http.https://{domain}/.proxy"
+                if key not in recorded:
+                    previous[key] = self.git_config_get(key)
+                self.run_command(f"git config --global {shlex.quote(key)} {shlex.quote(proxy or '')}",
+                                 f"设置 {domain} 的Git代理为 {proxy or '直连'}", silent=True)
+        
+        # 4. Docker守护进程代理（Docker 23+ 支持daemon.json中的proxies）
+        docker_domains = [domain for domain in config.get("docker_domains", []) if domain in self.proxy_routes]
+        self.apply_docker_proxy(docker_domains)
+        
+        state = load_state("proxy_routing")
+        state["git_config"] = dict(previous, **state.get("git_config", {}))
+        save_state("proxy_routing", state)
+        print("✅ 代理路由配置完成，可使用 --revert proxy_routing 恢复")
+    
+    def apply_docker_proxy(self, docker_domains: List[str]):
+        """为Docker守护进程选择使用最多的代理，直连的Docker域名写入no-proxy"""
+        if not docker_domains or not os.path.exists(DOCKER_DAEMON_FILE):
+            return
+        proxies = [self.proxy_routes[domain][0] for domain in docker_domains if self.proxy_routes[domain][0]]
+        try:
+            with open(DOCKER_DAEMON_FILE, 'r', encoding='utf-8') as f:
+                daemon_config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"    ⚠️  读取 {DOCKER_DAEMON_FILE} 失败: {e}")
+            return
+        
+        if proxies:
+            proxy = max(set(proxies), key=proxies.count)
+            direct = [domain for domain in docker_domains if self.proxy_routes[domain][0] != proxy]
+            # 国内镜像加速器（registry-mirrors）应当直连，除非测量结果表明经由代理更快
+            for mirror in daemon_config.get("registry-mirrors", []):
+                host = urlparse(mirror).hostname
+                if host and host not in direct and not self.proxy_routes.get(host, (None, ""))[0]:
+                    direct.append(host)
+            daemon_config["proxies"] = {
+                "http-proxy": proxy,
+                "https-proxy": proxy,
+                "no-proxy": ",".join(["localhost", "127.0.0.1"] + direct),
+            }
+        elif "proxies" in daemon_config:
+            daemon_config.pop("proxies")
+        else:
+            return
+        
+        self.write_generated_file("proxy_routing", DOCKER_DAEMON_FILE, json.dumps(daemon_config, indent=2) + "\n")
+        self.run_command("systemctl restart docker", "重启Docker服务")
+    
+    def revert_proxy_routing(self):
+        """移除按域名的代理路由配置"""
+        print("\n🔄 恢复代理路由配置...")
+        state = load_state("proxy_routing")
+        if not state:
+            print("✅ 未发现代理路由配置的修改记录，无需恢复")
+            return
+        for key, value in state.get("git_config", {}).items():
+            if value is None:
+                self.run_command(f"git config --global --unset-all {shlex.quote(key)}", f"移除 {key}", silent=True)
+            else:
+                self.run_command(f"git config --global {shlex.quote(key)} {shlex.quote(value)}",
+                                 f"恢复 {key}={value}", silent=True)
+        self.restore_rollback("proxy_routing")
+        if os.path.exists(DOCKER_DAEMON_FILE):
+            self.run_command("systemctl restart docker", "重启Docker服务")
     
     def create_optimization_report(self):
         """创建优化报告"""
+        import platform
         print("\n📊 优化报告")
         print("=" * 50)
         print(f"🌍 服务器位置: {'中国大陆' if self.is_china else '海外'}")
@@ -485,20 +2565,76 @@ class ServerOptimizer:
         print(f"💻 操作系统: {platform.system()} {platform.release()}")
         print("=" * 50)
         
-        if self.is_china:
-            print("✅ 已应用国内优化策略:")
-            print("    • 使用国内DNS服务器")
-            print("    • 配置GitHub镜像加速")
-            print("    • 配置Gitee访问优化")
-            print("    • 设置Docker国内镜像源")
-            print("    • 应用网络优化参数")
-        else:
-            print("✅ 已应用海外优化策略:")
-            print("    • 使用国际DNS服务器")
-            print("    • 配置GitHub官方访问")
-            print("    • 配置Gitee访问优化")
-            print("    • 设置Docker官方镜像源")
-            print("    • 应用网络优化参数")
+        print(f"🧩 优化配置: {self.profile.get('name')} - {self.profile.get('description', '')}")
+        print(f"📄 配置文件: {self.profile.get('path', 'Unknown')}")
+        print("=" * 50)
+        
+        region = 0 if self.is_china else 1
+        print(f"✅ 已应用{'国内' if self.is_china else '海外'}优化策略:")
+        for step in self.get_profile_steps():
+            if step not in self.failed_steps:
+                print(f"    • {STEP_DESCRIPTIONS.get(step, (step, step))[region]}")
+        if self.failed_steps:
+            print("❌ 未完成的步骤:")
+            for step, error in self.failed_steps.items():
+                print(f"    • {step}: {error}")
+        
+        # 列出与内核默认值不同的参数
+        if "network" in self.get_profile_steps():
+            changed = sysctl_changes(self.profile.get("sysctl", {}))
+            print(f"\n🔧 与内核默认值不同的参数 ({len(changed)} 项):")
+            for key, value, default in changed:
+                print(f"    • {key} = {value}  (内核默认: {default})")
+        
+        if "docker" in self.get_profile_steps():
+            print("\n🐳 Docker配置:")
+            for key, value in self.profile.get("docker", {}).items():
+                print(f"    • {key} = {json.dumps(value, ensure_ascii=False)}")
+        
+        if self.mirror_results:
+            print("\n📦 软件包镜像源:")
+            for ecosystem, results in self.mirror_results.items():
+                best = results[0] if results and results[0]["ok"] else None
+                if best:
+                    print(f"    • {ecosystem}: {best['mirror']} ({best['total_ms']:.0f}ms)")
+                else:
+                    print(f"    • {ecosystem}: 无可用镜像")
+        
+        if self.git_benchmark:
+            before, after = self.git_benchmark
+            print("\n⏱️  Git克隆测量:")
+            print(f"    • 优化前: {f'{before:.2f}s' if before is not None else '失败'}")
+            print(f"    • 优化后: {f'{after:.2f}s' if after is not None else '失败'}")
+        
+        if self.proxy_routes:
+            print("\n🧭 代理路由:")
+            for domain, (proxy, reason) in self.proxy_routes.items():
+                print(f"    • {domain} -> {proxy or '直连'}（{reason}）")
+        
+        if self.ip_measurements:
+            print("\n🔀 IPv4/IPv6测量结果:")
+            self.print_ip_measurements(self.ip_measurements)
+        
+        if "dns" in self.get_profile_steps():
+            dns_servers = self.profile.get("dns", {}).get("china" if self.is_china else "overseas", [])
+            print(f"\n🌐 DNS服务器: {', '.join(dns_servers)}")
+    
+    def run_step(self, step: str, method_name: Optional[str] = None) -> bool:
+        """执行单个步骤；写入系统文件失败（如以普通用户运行）时报告错误并继续，不中断整个流程"""
+        try:
+            getattr(self, method_name or OPTIMIZATION_STEPS[step])()
+            return True
+        except OSError as e:
+            self.failed_steps[step] = str(e)
+            print(f"❌ 步骤 {step} 未完成: {e}")
+            if os.geteuid() != 0:
+                print("💡 该步骤需要修改系统文件，请使用 sudo 运行")
+            return False
+    
+    def get_profile_steps(self) -> List[str]:
+        """返回当前配置中需要执行的优化步骤（保持注册顺序）"""
+        steps = self.profile.get("steps", list(OPTIMIZATION_STEPS))
+        return [step for step in steps if step in OPTIMIZATION_STEPS]
     
     def run_optimization(self):
         """执行完整的优化流程"""
@@ -519,12 +2655,13 @@ class ServerOptimizer:
         self.is_china = self.detect_location(ip)
         print(f"📍 地理位置: {'中国大陆' if self.is_china else '海外'}")
         
-        # 3. 执行优化
-        self.optimize_dns()
-        self.optimize_github()
-        self.optimize_gitee() # 新增Gitee优化
-        self.optimize_docker()
-        self.optimize_network()
+        # 3. 按优化配置执行各步骤
+        print(f"\n🧩 使用优化配置: {self.profile.get('name')}")
+        for step in self.profile.get("steps", list(OPTIMIZATION_STEPS)):
+            if step not in OPTIMIZATION_STEPS:
+                print(f"⚠️  未知的优化步骤 '{step}'，已跳过")
+                continue
+            self.run_step(step)
         
         # 4. 生成报告
         self.create_optimization_report()
@@ -720,8 +2857,12 @@ class ServerOptimizer:
         print("\n6. 尝试自动修复...")
         self.attempt_auto_fix()
         
-        # 7. 提供备选方案
-        self.provide_gitee_alternatives()
+        # 7. 配置了候选代理时自动测速并生成路由，否则提供备选方案
+        if self.get_proxy_candidates():
+            print("\n7. 使用候选代理自动配置路由...")
+            self.run_step("proxy_routing")
+        else:
+            self.provide_gitee_alternatives()
     
     def provide_gitee_alternatives(self):
         """提供Gitee访问的备选方案"""
@@ -781,6 +2922,8 @@ class ServerOptimizer:
         print("    # 或者使用国内CDN服务")
         
         print("\n" + "=" * 50)
+        print("💡 如有可用代理，可运行以下命令自动测速并按域名生成代理路由:")
+        print("    sudo python3 server_optimizer.py --proxy http://proxy-server:port --proxy socks5://proxy-server:port")
         print("💡 建议按顺序尝试以上方案")
         print("📞 如果问题持续存在，请联系网络管理员或ISP")
     
@@ -836,9 +2979,135 @@ class ServerOptimizer:
         print("    # 在GitHub Actions或其他CI/CD中使用国内服务器")
         
         print("\n" + "=" * 60)
+        print("💡 如有可用的国内代理，可运行以下命令自动测速并按域名生成代理路由:")
+        print("    sudo python3 server_optimizer.py --proxy http://your-china-proxy:port")
         print("💡 建议按顺序尝试以上方案")
         print("📞 如果问题持续存在，请联系网络管理员或ISP")
 
+def run_fetch(args, profile: Dict) -> int:
+    """处理 fetch 子命令"""
+    config = profile.get("fetch", {})
+    mirrors = list(args.mirror)
+    # 按配置的模板为GitHub等域名生成等价的镜像地址
+    if urlparse(args.url).hostname in config.get("template_hosts", []):
+        mirrors += [template.format(url=args.url) for template in config.get("mirror_templates", [])]
+    
+    print(f"📡 测量下载地址速度: {args.url}")
+    try:
+        path = fetch(args.url, args.output, mirrors, args.checksum,
+                     args.connections or config.get("connections", 4))
+    except (RuntimeError, OSError, ValueError) as e:
+        print(f"❌ 下载失败: {e}")
+        return 1
+    print(f"✅ 已保存到 {path}")
+    return 0
+
+
+def run_git_cache(args, profile: Dict) -> int:
+    """处理 git-cache 子命令"""
+    cache = GitMirrorCache.from_profile(profile)
+    if args.cache_dir:
+        cache = GitMirrorCache(args.cache_dir, cache.max_size // 1024 // 1024,
+                               cache.refresh_interval, cache.dissociate)
+    
+    try:
+        if args.action == "clone":
+            return cache.clone(args.url, args.dest, args.git_args)
+        if args.action == "refresh":
+            if args.url:
+                return 0 if cache.refresh(args.url) else 1
+            print(f"✅ 已更新 {cache.refresh_all()} 个镜像")
+        elif args.action == "evict":
+            evicted = cache.evict()
+            print(f"✅ 已淘汰 {len(evicted)} 个镜像" + (f": {', '.join(evicted)}" if evicted else ""))
+        elif args.action == "stats":
+            cache.print_stats()
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="智能服务器优化工具")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE,
+                        help="优化配置名称或文件路径，使用 auto 按硬件和服务自动选择（默认: general）")
+    parser.add_argument("--list-profiles", action="store_true", help="列出所有可用的优化配置")
+    parser.add_argument("--suggest-profile", action="store_true", help="根据硬件和运行中的服务推荐优化配置")
+    parser.add_argument("--proxy", action="append", default=[], metavar="URL",
+                        help="候选上游代理（http://、socks5://），可重复指定，用于按域名测速选择路由")
+    parser.add_argument("--revert", metavar="STEP", choices=REVERTIBLE_STEPS,
+                        help=f"撤销某个优化步骤的配置，可选: {', '.join(REVERTIBLE_STEPS)}")
+    
+    subparsers = parser.add_subparsers(dest="command")
+    git_cache = subparsers.add_parser("git-cache", help="本地git镜像缓存")
+    git_cache.add_argument("--cache-dir", help="缓存目录（默认取优化配置中的 git_cache.dir）")
+    actions = git_cache.add_subparsers(dest="action")
+    actions.required = True
+    clone = actions.add_parser("clone", help="借助本地镜像克隆仓库，额外的git参数放在 -- 之后")
+    clone.add_argument("url")
+    clone.add_argument("dest", nargs="?")
+    refresh = actions.add_parser("refresh", help="增量更新镜像（默认更新全部）")
+    refresh.add_argument("url", nargs="?")
+    actions.add_parser("stats", help="显示命中率和占用空间")
+    actions.add_parser("evict", help="按最近使用时间淘汰超出上限的镜像")
+    
+    fetch_parser = subparsers.add_parser("fetch", help="多连接分段下载，支持镜像、续传和校验")
+    fetch_parser.add_argument("url")
+    fetch_parser.add_argument("-o", "--output", help="保存路径（默认取URL中的文件名）")
+    fetch_parser.add_argument("--mirror", action="append", default=[], metavar="URL",
+                              help="同一文件的等价下载地址，可重复指定")
+    fetch_parser.add_argument("--checksum", metavar="ALGO:HEX", help="校验值，如 sha256:abcd...（只给十六进制时按sha256）")
+    fetch_parser.add_argument("-c", "--connections", type=int, help="并发连接数（默认取配置中的 fetch.connections）")
+    # git-cache clone 的额外git参数放在 -- 之后，先取出，避免被解析为目标目录
+    argv = list(sys.argv[1:] if argv is None else argv)
+    git_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, git_args = argv[:index], argv[index + 1:]
+    args = parser.parse_args(argv)
+    if git_args and getattr(args, "action", None) != "clone":
+        parser.error("只有 git-cache clone 支持 -- 之后的额外参数")
+    args.git_args = git_args
+
+    if args.list_profiles:
+        for name, path in list_profiles().items():
+            print(f"{name:<16} {path}")
+        return 0
+
+    if args.revert:
+        return 0 if ServerOptimizer().run_step(args.revert, f"revert_{args.revert}") else 1
+
+    profile_name = args.profile
+    # 子命令不需要推荐配置，避免扫描进程列表
+    if args.suggest_profile or profile_name == "auto" or not args.command:
+        suggested, reason = suggest_profile()
+        if args.suggest_profile:
+            print(f"💡 推荐优化配置: {suggested}（{reason}）")
+            return 0
+        if profile_name == "auto":
+            profile_name = suggested
+            print(f"💡 自动选择优化配置: {suggested}（{reason}）")
+        elif profile_name != suggested:
+            print(f"💡 推荐优化配置: {suggested}（{reason}），可使用 --profile {suggested}")
+
+    try:
+        profile = load_profile(profile_name)
+    except (ValueError, OSError) as e:
+        print(f"❌ 加载优化配置失败: {e}")
+        return 1
+
+    if args.command == "git-cache":
+        return run_git_cache(args, profile)
+    if args.command == "fetch":
+        return run_fetch(args, profile)
+
+    if args.proxy:
+        routing = profile.setdefault("proxy_routing", {})
+        routing["proxies"] = routing.get("proxies", []) + args.proxy
+
+    optimizer = ServerOptimizer(profile)
+    return 0 if optimizer.run_optimization() else 1
+
 if __name__ == "__main__":
-    optimizer = ServerOptimizer()
-    optimizer.run_optimization()
+    sys.exit(main())
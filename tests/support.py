@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+测试共用的本地服务：在回环地址上启动HTTP服务和代理，代替真实的镜像站、下载地址和上游代理
+"""
+
+import base64
+import contextlib
+import http.server
+import os
+import re
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+class QuietHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def make_file_handler(files, ranges: bool = True, status: int = None, fail_from: int = None, headers=None):
+    """返回按路径提供 files 中内容的处理器，可选择是否支持Range请求、固定返回某个状态码，
+    或对起始位置不小于 fail_from 的Range请求返回503；headers 是每个响应附带的响应头（如ETag）。
+    fail_from 和 response_headers 保存为类属性，测试中可在服务运行时修改
+    """
+
+    class FileHandler(QuietHandler):
+        requests = []
+
+        def do_GET(self):
+            fail_from = FileHandler.fail_from
+            FileHandler.requests.append((self.path, self.headers.get("Range")))
+            if status is not None:
+                self.send_body(status, b"")
+                return
+            data = files.get(self.path.split("?", 1)[0])
+            if data is None:
+                self.send_body(404, b"not found")
+                return
+            match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+            if ranges and match:
+                start = int(match.group(1))
+                if fail_from is not None and start >= fail_from:
+                    self.send_body(503, b"")
+                    return
+                end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+                self.send_body(206, data[start:end + 1],
+                               dict(FileHandler.response_headers, **{"Content-Range": f"bytes {start}-{end}/{len(data)}"}))
+            else:
+                self.send_body(200, data, FileHandler.response_headers)
+
+    FileHandler.fail_from = fail_from
+    FileHandler.response_headers = dict(headers or {})
+    return FileHandler
+
+
+@contextlib.contextmanager
+def serve(handler):
+    """在随机端口启动HTTP服务，返回基础URL"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_git_http_handler(root: str):
+    """返回通过 git http-backend（CGI）提供 root 下裸仓库的处理器，headers 记录每个请求的请求头"""
+
+    class GitHTTPHandler(QuietHandler):
+        headers_seen = []
+
+        def do_GET(self):
+            self.run_backend()
+
+        def do_POST(self):
+            self.run_backend()
+
+        def run_backend(self):
+            GitHTTPHandler.headers_seen.append(dict(self.headers))
+            path, _, query = self.path.partition("?")
+            env = dict(os.environ, GIT_PROJECT_ROOT=root, GIT_HTTP_EXPORT_ALL="1",
+                       REQUEST_METHOD=self.command, PATH_INFO=path, QUERY_STRING=query,
+                       CONTENT_TYPE=self.headers.get("Content-Type", ""),
+                       GIT_PROTOCOL=self.headers.get("Git-Protocol", ""),
+                       HTTP_CONTENT_ENCODING=self.headers.get("Content-Encoding", ""),
+                       REMOTE_ADDR="127.0.0.1")
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                body = self.read_chunked()
+            output = subprocess.run(["git", "http-backend"], input=body, env=env,
+                                    capture_output=True).stdout
+            head, _, content = output.partition(b"\r\n\r\n")
+            headers = dict(line.split(": ", 1) for line in head.decode("latin-1").split("\r\n") if ": " in line)
+            status = int(headers.pop("Status", "200").split()[0])
+            self.send_body(status, content, headers)
+
+        def read_chunked(self) -> bytes:
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+
+    return GitHTTPHandler
+
+
+@contextlib.contextmanager
+def git_daemon(root: str):
+    """在随机端口启动 git daemon 提供 root 下的裸仓库，返回基础URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(["git", "daemon", "--reuseaddr", "--export-all", f"--base-path={root}",
+                                "--listen=127.0.0.1", f"--port={port}", root],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise
+                time.sleep(0.05)
+        yield f"git://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _relay(client: socket.socket, upstream: socket.socket):
+    """双向转发数据，直到任意一端关闭"""
+    def pipe(source, target):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                target.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                target.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=pipe, args=(upstream, client), daemon=True)
+    thread.start()
+    pipe(client, upstream)
+    thread.join()
+
+
+class ProxyServer(socketserver.ThreadingTCPServer):
+    """同时支持HTTP代理（CONNECT和绝对地址GET）与SOCKS5的代理
+
+    credentials: 要求的 (用户名, 密码)；connect_ports: 允许CONNECT的端口；
+    socks_error: SOCKS5连接请求固定返回的错误码；hosts: 代理侧的域名解析；delay: 每个连接的额外延迟
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, credentials=None, connect_ports=None, socks_error=None, hosts=None, delay=0.0):
+        self.credentials = credentials
+        self.connect_ports = connect_ports
+        self.socks_error = socks_error
+        self.hosts = hosts or {}
+        self.delay = delay
+        self.requests = []
+        super().__init__(("127.0.0.1", 0), ProxyHandler)
+
+    def open_upstream(self, host: str, port: int) -> socket.socket:
+        return socket.create_connection((self.hosts.get(host, host), port), timeout=5)
+
+
+class ProxyHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        time.sleep(self.server.delay)
+        if self.request.recv(1, socket.MSG_PEEK) == b"\x05":
+            self.handle_socks()
+        else:
+            self.handle_http()
+
+    def handle_http(self):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            data += chunk
+        head, _, body = data.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+        self.server.requests.append((method, target, headers.get("Proxy-Authorization")))
+
+        if self.server.credentials:
+            expected = "Basic " + base64.b64encode(":".join(self.server.credentials).encode()).decode()
+            if headers.get("Proxy-Authorization") != expected:
+                self.request.sendall(b"HTTP/1.1 407 Proxy Authentication Required\r\nContent-Length: 0\r\n\r\n")
+                return
+
+        if method == "CONNECT":
+            host, _, port = target.rpartition(":")
+            if self.server.connect_ports is not None and int(port) not in self.server.connect_ports:
+                self.request.sendall(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+                return
+            upstream = self.server.open_upstream(host, int(port))
+            self.request.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        else:
+            match = re.match(r"http://([^/:]+)(?::(\d+))?(/.*)?$", target)
+            if not match:
+                self.request.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                return
+            host, port, path = match.group(1), int(match.group(2) or 80), match.group(3) or "/"
+            upstream = self.server.open_upstream(host, port)
+            forwarded = [f"{method} {path} {version}"]
+            forwarded += [f"{name}: {value}" for name, value in headers.items()
+                          if not name.lower().startswith("proxy-") and name.lower() != "connection"]
+            forwarded.append("Connection: close")
+            upstream.sendall(("\r\n".join(forwarded) + "\r\n\r\n").encode("latin-1") + body)
+        with upstream:
+            _relay(self.request, upstream)
+
+    def recv_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise OSError("客户端提前关闭连接")
+            data += chunk
+        return data
+
+    def handle_socks(self):
+        _, count = self.recv_exact(2)
+        methods = self.recv_exact(count)
+        method = 0x02 if self.server.credentials else 0x00
+        if method not in methods:
+            self.request.sendall(b"\x05\xff")
+            return
+        self.request.sendall(bytes([5, method]))
+        if method == 0x02:
+            _, length = self.recv_exact(2)
+            user = self.recv_exact(length).decode()
+            password = self.recv_exact(self.recv_exact(1)[0]).decode()
+            ok = (user, password) == tuple(self.server.credentials)
+            self.request.sendall(b"\x01\x00" if ok else b"\x01\x01")
+            if not ok:
+                return
+
+        _, _, _, address_type = self.recv_exact(4)
+        if address_type == 0x03:
+            host = self.recv_exact(self.recv_exact(1)[0]).decode()
+        else:
+            host = socket.inet_ntop(socket.AF_INET if address_type == 0x01 else socket.AF_INET6,
+                                    self.recv_exact(4 if address_type == 0x01 else 16))
+        port = int.from_bytes(self.recv_exact(2), "big")
+        self.server.requests.append(("SOCKS5", f"{host}:{port}", None))
+        if self.server.socks_error:
+            self.request.sendall(bytes([5, self.server.socks_error, 0, 1]) + bytes(6))
+            return
+        upstream = self.server.open_upstream(host, port)
+        self.request.sendall(b"\x05\x00\x00\x01" + bytes(6))
+        with upstream:
+            _relay(self.request, upstream)
+
+
+@contextlib.contextmanager
+def proxy(**options):
+    """启动本地代理，返回 (代理服务, 代理地址中的 host:port)"""
+    server = ProxyServer(**options)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield server, f"127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
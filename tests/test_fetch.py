@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""fetch：本地支持Range的HTTP服务代替下载地址和镜像"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+
+from support import make_file_handler, serve
+
+import server_optimizer
+
+MB = 1024 * 1024
+DATA = os.urandom(3 * MB + 12345)
+SHA256 = "sha256:" + hashlib.sha256(DATA).hexdigest()
+
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dest = os.path.join(self.tmp.name, "file.bin")
+
+    def read_dest(self) -> bytes:
+        with open(self.dest, "rb") as f:
+            return f.read()
+
+    def assert_no_partial_files(self):
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+        self.assertFalse(os.path.exists(self.dest + ".part.json"))
+
+    def test_segments_spread_across_mirrors(self):
+        first, second = make_file_handler({"/f": DATA}), make_file_handler({"/f": DATA})
+        with serve(first) as a, serve(second) as b, serve(make_file_handler({}, status=503)) as broken:
+            path = server_optimizer.fetch(a + "/f", self.dest, [b + "/f", broken + "/f"], SHA256, connections=4)
+
+        self.assertEqual(path, self.dest)
+        self.assertEqual(self.read_dest(), DATA)
+        self.assert_no_partial_files()
+        # 每个地址除探测请求外都分到了分段
+        self.assertGreater(len(first.requests), 1)
+        self.assertGreater(len(second.requests), 1)
+        self.assertTrue(all(header and header.startswith("bytes=") for _, header in first.requests))
+
+    def test_mirror_with_different_size_is_ignored(self):
+        other = make_file_handler({"/f": DATA + b"extra"})
+        with serve(make_file_handler({"/f": DATA})) as primary, serve(other) as mirror:
+            server_optimizer.fetch(primary + "/f", self.dest, [mirror + "/f"], SHA256)
+        self.assertEqual(self.read_dest(), DATA)
+        # 镜像只收到探测请求
+        self.assertEqual(len(other.requests), 1)
+
+    def interrupted(self, handler, url: str, checksum=SHA256):
+        """对2MB之后的分段返回503，留下未完成的下载"""
+        handler.fail_from = 2 * MB
+        with self.assertRaisesRegex(RuntimeError, "可重新执行以续传"):
+            server_optimizer.fetch(url, self.dest, checksum=checksum, connections=2)
+        self.assertTrue(os.path.exists(self.dest + ".part.json"))
+        handler.fail_from = None
+        del handler.requests[:]
+
+    def segment_starts(self, handler):
+        """各分段请求的起始位置（不含探测请求）"""
+        return [int(header[len("bytes="):].split("-")[0]) for _, header in handler.requests[1:]]
+
+    def test_resume_after_failure(self):
+        handler = make_file_handler({"/f": DATA}, headers={"ETag": '"v1"'})
+        with serve(handler) as url:
+            self.interrupted(handler, url + "/f")
+            server_optimizer.fetch(url + "/f", self.dest, checksum=SHA256, connections=2)
+        self.assertEqual(self.read_dest(), DATA)
+        self.assert_no_partial_files()
+        # 续传时只下载失败的分段
+        starts = self.segment_starts(handler)
+        self.assertTrue(starts)
+        self.assertTrue(all(start >= 2 * MB for start in starts), starts)
+
+    def test_changed_file_with_same_size_restarts(self):
+        files = {"/f": DATA}
+        handler = make_file_handler(files, headers={"ETag": '"v1"'})
+        changed = os.urandom(len(DATA))
+        with serve(handler) as url:
+            self.interrupted(handler, url + "/f", checksum=None)
+            # 服务端文件换成大小相同的新版本，不能与之前下载的数据拼接
+            files["/f"] = changed
+            handler.response_headers["ETag"] = '"v2"'
+            server_optimizer.fetch(url + "/f", self.dest, connections=2)
+        self.assertEqual(self.read_dest(), changed)
+        self.assertIn(0, self.segment_starts(handler))
+
+    def test_different_url_restarts(self):
+        other = os.urandom(len(DATA))
+        handler = make_file_handler({"/f": DATA, "/g": other},
+                                    headers={"Last-Modified": "Mon, 05 Oct 2026 00:00:00 GMT"})
+        with serve(handler) as url:
+            self.interrupted(handler, url + "/f", checksum=None)
+            server_optimizer.fetch(url + "/g", self.dest, connections=2)
+        self.assertEqual(self.read_dest(), other)
+        self.assertIn(0, self.segment_starts(handler))
+
+    def test_no_validator_resumes_only_with_checksum(self):
+        handler = make_file_handler({"/f": DATA})
+        with serve(handler) as url:
+            self.interrupted(handler, url + "/f", checksum=None)
+            server_optimizer.fetch(url + "/f", self.dest, connections=2)
+            self.assertIn(0, self.segment_starts(handler))
+
+            os.remove(self.dest)
+            self.interrupted(handler, url + "/f")
+            server_optimizer.fetch(url + "/f", self.dest, checksum=SHA256, connections=2)
+            self.assertNotIn(0, self.segment_starts(handler))
+        self.assertEqual(self.read_dest(), DATA)
+
+    def test_checksum_mismatch_removes_partial_files(self):
+        with serve(make_file_handler({"/f": DATA})) as url:
+            with self.assertRaisesRegex(RuntimeError, "sha256校验失败"):
+                server_optimizer.fetch(url + "/f", self.dest, checksum="sha256:" + "0" * 64)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assert_no_partial_files()
+
+    def test_single_connection_without_range_support(self):
+        with serve(make_file_handler({"/f": DATA}, ranges=False)) as url:
+            server_optimizer.fetch(url + "/f", self.dest, checksum=hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(self.read_dest(), DATA)
+        self.assert_no_partial_files()
+
+    def test_all_endpoints_unavailable(self):
+        with serve(make_file_handler({}, status=404)) as url:
+            with self.assertRaisesRegex(RuntimeError, "所有下载地址均不可用"):
+                server_optimizer.fetch(url + "/f", self.dest)
+
+
+if __name__ == "__main__":
+    unittest.main()
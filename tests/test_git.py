@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""git 步骤：临时HOME中的全局配置，git http-backend 和 git daemon 代替上游和镜像"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from support import git_daemon, make_git_http_handler, serve
+
+import server_optimizer
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@unittest.skipUnless(shutil.which("git"), "需要git")
+class OptimizeGitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        home = os.path.join(self.tmp.name, "home")
+        os.makedirs(home)
+        for patcher in (
+            mock.patch.dict(os.environ, {"HOME": home, "GIT_CONFIG_NOSYSTEM": "1"}),
+            mock.patch.object(server_optimizer, "STATE_DIR", os.path.join(self.tmp.name, "state")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        git("config", "--global", "pack.threads", "4")
+
+        self.srv = os.path.join(self.tmp.name, "srv")
+        self.make_repo("upstream", "upstream commit")
+        self.make_repo("upstream-next", "upstream-next commit")
+        self.make_repo("mirror", "mirror commit")
+
+        self.http = make_git_http_handler(self.srv)
+        for context in (serve(self.http), git_daemon(self.srv)):
+            base_url = context.__enter__()
+            self.addCleanup(context.__exit__, None, None, None)
+            if base_url.startswith("http"):
+                self.http_url = base_url
+            else:
+                self.daemon_url = base_url
+        self.upstream = self.http_url + "/upstream"
+        self.mirror = self.daemon_url + "/mirror"
+
+    def make_repo(self, name: str, message: str):
+        work = os.path.join(self.tmp.name, name + "-work")
+        git("init", "--quiet", work)
+        git("-c", "user.name=test", "-c", "user.email=test@example.com",
+            "commit", "--quiet", "--allow-empty", "-m", message, cwd=work)
+        git("clone", "--quiet", "--bare", work, os.path.join(self.srv, name + ".git"))
+
+    def clone(self, url: str) -> subprocess.CompletedProcess:
+        dest = os.path.join(tempfile.mkdtemp(dir=self.tmp.name), "repo")
+        result = subprocess.run(["git", "clone", url, dest], capture_output=True, text=True,
+                                env=dict(os.environ, GIT_TRACE_PACKET="1"))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        result.subject = git("log", "-1", "--format=%s", cwd=dest)
+        return result
+
+    def test_measure_clone(self):
+        optimizer = server_optimizer.ServerOptimizer({})
+        self.assertIsInstance(optimizer.measure_clone(self.upstream + ".git", attempts=2), float)
+        self.assertIsNone(optimizer.measure_clone(self.http_url + "/missing.git"))
+
+    def test_optimize_and_revert(self):
+        optimizer = server_optimizer.ServerOptimizer({"git": {
+            "config": {"pack.threads": "0", "protocol.version": "2", "http.version": "HTTP/2"},
+            "mirrored_repos": {self.upstream: self.mirror + ".git"},
+            "benchmark": True,
+            "benchmark_repo": self.upstream + ".git",
+        }})
+        optimizer.is_china = True
+        optimizer.optimize_git()
+
+        before, after = optimizer.git_benchmark
+        self.assertIsInstance(before, float)
+        self.assertIsInstance(after, float)
+        self.assertEqual(git("config", "--global", "pack.threads"), "0")
+        self.assertEqual(git("config", "--global", "protocol.version"), "2")
+
+        # 两种写法都改写到git daemon上的镜像，并使用v2协议
+        for url in (self.upstream, self.upstream + ".git"):
+            result = self.clone(url)
+            self.assertEqual(result.subject, "mirror commit")
+            self.assertIn("< version 2", result.stderr)
+        # 名称以它开头的其他仓库不受影响，经由HTTP传输时请求升级到HTTP/2
+        self.http.headers_seen.clear()
+        self.assertEqual(self.clone(self.http_url + "/upstream-next").subject, "upstream-next commit")
+        self.assertEqual(self.http.headers_seen[0].get("Upgrade"), "h2c")
+        self.assertEqual(self.http.headers_seen[0].get("Git-Protocol"), "version=2")
+
+        optimizer.revert_git()
+        self.assertEqual(git("config", "--global", "pack.threads"), "4")
+        self.assertIsNone(optimizer.git_config_get("protocol.version"))
+        self.assertIsNone(optimizer.git_config_get("include.path"))
+        self.assertEqual(self.clone(self.upstream).subject, "upstream commit")
+        self.assertEqual(server_optimizer.load_state("git"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
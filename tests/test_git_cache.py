@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""git_cache 步骤：本地裸仓库代替上游，临时HOME中的insteadOf改写"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  将仓库根目录加入sys.path
+
+import server_optimizer
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@unittest.skipUnless(shutil.which("git"), "需要git")
+class GitCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        home = os.path.join(self.tmp.name, "home")
+        os.makedirs(home)
+        for patcher in (
+            mock.patch.dict(os.environ, {"HOME": home, "GIT_CONFIG_NOSYSTEM": "1"}),
+            mock.patch.object(server_optimizer, "STATE_DIR", os.path.join(self.tmp.name, "state")),
+            mock.patch.object(server_optimizer, "GIT_CACHE_CRON_FILE", os.path.join(self.tmp.name, "cron")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        self.bar = self.make_repo("foo/bar", "bar v1")
+        self.barbaz = self.make_repo("foo/barbaz", "barbaz v1")
+
+    def make_repo(self, name: str, message: str) -> str:
+        """创建 <tmp>/upstream/<name>.git，返回不带 .git 的地址"""
+        work = os.path.join(self.tmp.name, "work", name)
+        git("init", "--quiet", work)
+        self.commit(work, message)
+        bare = os.path.join(self.tmp.name, "upstream", name + ".git")
+        git("clone", "--quiet", "--bare", work, bare)
+        git("remote", "add", "origin", bare, cwd=work)
+        return "file://" + bare[:-len(".git")]
+
+    def commit(self, work: str, message: str):
+        git("-c", "user.name=test", "-c", "user.email=test@example.com",
+            "commit", "--quiet", "--allow-empty", "-m", message, cwd=work)
+
+    def last_commit(self, url: str) -> str:
+        dest = os.path.join(tempfile.mkdtemp(dir=self.tmp.name), "repo")
+        git("clone", "--quiet", url, dest)
+        return git("log", "-1", "--format=%s", cwd=dest)
+
+    def optimize(self, repos):
+        optimizer = server_optimizer.ServerOptimizer({"git_cache": {
+            "dir": self.cache_dir, "repos": repos, "insteadof": True}})
+        optimizer.optimize_git_cache()
+        return optimizer
+
+    def push(self, name: str, message: str):
+        work = os.path.join(self.tmp.name, "work", name)
+        self.commit(work, message)
+        git("push", "--quiet", "origin", "HEAD", cwd=work)
+
+    def test_insteadof_matches_only_the_cached_repo(self):
+        optimizer = self.optimize([self.bar])
+        cache = server_optimizer.GitMirrorCache(self.cache_dir)
+        # 全局配置中只有一行 include.path，改写规则都在缓存目录的文件中
+        self.assertEqual(git("config", "--global", "--list"), f"include.path={cache.insteadof_file}")
+
+        # 上游不可用时，两种写法仍然从镜像克隆
+        upstream = self.bar[len("file://"):] + ".git"
+        os.rename(upstream, upstream + ".moved")
+        self.assertEqual(self.last_commit(self.bar + ".git"), "bar v1")
+        self.assertEqual(self.last_commit(self.bar), "bar v1")
+        os.rename(upstream + ".moved", upstream)
+
+        # 名称以 bar 开头的其他仓库不被改写
+        self.push("foo/barbaz", "barbaz v2")
+        self.assertEqual(self.last_commit(self.barbaz + ".git"), "barbaz v2")
+        self.assertEqual(self.last_commit(self.barbaz), "barbaz v2")
+
+        # 镜像自身的更新不受改写影响，之后的透明克隆得到新提交
+        self.push("foo/bar", "bar v2")
+        self.assertTrue(cache.refresh(self.bar))
+        self.assertEqual(self.last_commit(self.bar), "bar v2")
+
+        optimizer.revert_git_cache()
+        self.assertEqual(git("config", "--global", "--list"), "")
+        self.assertFalse(os.path.exists(cache.insteadof_file))
+
+    def test_cache_clone_fetches_from_upstream(self):
+        self.optimize([self.bar])
+        self.push("foo/bar", "bar v2")
+        dest = os.path.join(self.tmp.name, "clone")
+        cache = server_optimizer.GitMirrorCache(self.cache_dir)
+        self.assertEqual(cache.clone(self.bar, dest, ["--quiet"]), 0)
+        self.assertEqual(git("log", "-1", "--format=%s", cwd=dest), "bar v2")
+        self.assertEqual(git("config", "remote.origin.url", cwd=dest), self.bar)
+
+    def test_clone_dir_name(self):
+        name = server_optimizer.GitMirrorCache.clone_dir_name
+        self.assertEqual(name("https://github.com/foo/bar.git"), "bar")
+        self.assertEqual(name("https://github.com/foo/bar/"), "bar")
+        self.assertEqual(name("git@github.com:foo/bar.git", ["--bare"]), "bar.git")
+
+    def test_eviction_drops_insteadof_rewrite(self):
+        self.optimize([self.bar])
+        self.push("foo/bar", "bar v2")
+        cache = server_optimizer.GitMirrorCache(self.cache_dir, max_size_mb=0)
+        self.assertEqual(cache.evict(), [cache.mirror_path(self.bar)])
+
+        # 镜像被淘汰后直接克隆回到上游，而不是指向不存在的镜像
+        self.assertEqual(self.last_commit(self.bar), "bar v2")
+        with open(cache.insteadof_file, encoding="utf-8") as f:
+            self.assertNotIn("foo/bar", f.read())
+
+    def test_stats_keyed_by_mirror_path(self):
+        cache = server_optimizer.GitMirrorCache(self.cache_dir)
+        cache.ensure(self.bar)
+        cache.ensure(self.bar + ".git")
+
+        repos = cache.load_stats()["repos"]
+        self.assertEqual(list(repos), [cache.mirror_path(self.bar)])
+        self.assertEqual((repos[cache.mirror_path(self.bar)]["hits"],
+                          repos[cache.mirror_path(self.bar)]["misses"]), (1, 1))
+
+        cache.max_size = 0
+        self.assertEqual(cache.evict(), [cache.mirror_path(self.bar)])
+        self.assertEqual(cache.load_stats()["repos"], {})
+
+    def test_clone_passes_git_args_after_separator(self):
+        dest = os.path.join(self.tmp.name, "clone")
+        argv = ["git-cache", "--cache-dir", self.cache_dir, "clone", self.bar, dest, "--", "--quiet", "--bare"]
+        self.assertEqual(server_optimizer.main(argv), 0)
+        self.assertEqual(git("rev-parse", "--is-bare-repository", cwd=dest), "true")
+
+        with mock.patch.object(server_optimizer.GitMirrorCache, "clone", return_value=0) as clone:
+            server_optimizer.main(["git-cache", "clone", self.bar, "--", "--depth", "1"])
+        clone.assert_called_once_with(self.bar, None, ["--depth", "1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
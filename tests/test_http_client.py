@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""HTTPClient 和 launcher.py：本地HTTP服务与代理代替真实站点"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from support import QuietHandler, ROOT_DIR, make_file_handler, proxy, serve
+
+import server_optimizer
+
+
+class RedirectHandler(QuietHandler):
+    connections = set()
+
+    def do_GET(self):
+        RedirectHandler.connections.add(self.client_address)
+        if self.path == "/old":
+            self.send_body(302, b"", {"Location": "/new?x=1"})
+        else:
+            self.send_body(200, self.path.encode())
+
+
+class HTTPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = server_optimizer.HTTPClient()
+        self.addCleanup(self.client.close)
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ("http_proxy", "https_proxy", "all_proxy", "no_proxy",
+                     "HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY", "NO_PROXY"):
+            os.environ.pop(name, None)
+
+    def test_redirect_reuses_connection(self):
+        RedirectHandler.connections = set()
+        with serve(RedirectHandler) as base_url:
+            response = self.client.get(base_url + "/old")
+            self.assertEqual(self.client.get(base_url + "/other").text, "/other")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "/new?x=1")
+        self.assertEqual(response.url, base_url + "/new?x=1")
+        self.assertEqual(len(RedirectHandler.connections), 1)
+
+    def test_plain_http_through_http_proxy(self):
+        # 与常见代理一样只允许CONNECT到443，明文HTTP必须发送绝对地址请求
+        handler = make_file_handler({"/ip": b"ok"})
+        with serve(handler) as base_url, \
+                proxy(credentials=("user", "p@ss"), connect_ports={443}) as (server, address):
+            os.environ["http_proxy"] = f"http://user:p%40ss@{address}"
+            response = self.client.get(base_url + "/ip")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "ok")
+        method, target, authorization = server.requests[0]
+        self.assertEqual((method, target), ("GET", base_url + "/ip"))
+        self.assertEqual(authorization, server_optimizer.proxy_authorization(f"http://user:p%40ss@{address}"))
+
+    def test_no_proxy_bypasses_proxy(self):
+        with serve(make_file_handler({"/": b"direct"})) as base_url, proxy() as (server, address):
+            os.environ["http_proxy"] = f"http://{address}"
+            os.environ["no_proxy"] = "127.0.0.1"
+            self.assertEqual(self.client.get(base_url + "/").text, "direct")
+        self.assertEqual(server.requests, [])
+
+
+class LauncherTest(unittest.TestCase):
+
+    def test_ignores_modules_in_current_directory(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            marker = os.path.join(cwd, "imported")
+            with open(os.path.join(cwd, "json.py"), "w") as f:
+                f.write(f"open({marker!r}, 'w').close()\n")
+            result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, "launcher.py"), "--list-profiles"],
+                                    cwd=cwd, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertFalse(os.path.exists(marker))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""ip_preference 步骤：回环地址上的监听端口代替真实端点，临时文件代替 /etc/hosts 和 /etc/gai.conf"""
+
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  将仓库根目录加入sys.path
+
+import server_optimizer
+
+
+def family_result(address, success_rate, latency_ms):
+    return {"address": address, "success_rate": success_rate, "latency_ms": latency_ms}
+
+
+def measurement(host, choice, v4="192.0.2.1", v6="2001:db8::1"):
+    return {"endpoint": host, "host": host, "choice": choice, "reason": "测试",
+            "ipv4": family_result(v4, 1.0, 10), "ipv6": family_result(v6, 1.0, 10)}
+
+
+class ChooseIPFamilyTest(unittest.TestCase):
+
+    def test_choices(self):
+        choose = server_optimizer.choose_ip_family
+        v4 = family_result("192.0.2.1", 1.0, 20)
+        self.assertEqual(choose(v4, family_result(None, 0.0, None))[0], "any")
+        self.assertEqual(choose(family_result(None, 0.0, None), family_result("2001:db8::1", 1.0, 20))[0], "any")
+        self.assertEqual(choose(v4, family_result("2001:db8::1", 0.0, None)),
+                         ("ipv4", "IPv6路径不可达"))
+        self.assertEqual(choose(family_result("192.0.2.1", 0.0, None), family_result("2001:db8::1", 1.0, 20))[0],
+                         "ipv6")
+        self.assertEqual(choose(v4, family_result("2001:db8::1", 0.5, 20))[0], "ipv4")
+        self.assertEqual(choose(v4, family_result("2001:db8::1", 1.0, 200))[0], "ipv4")
+        self.assertEqual(choose(family_result("192.0.2.1", 1.0, 200), family_result("2001:db8::1", 1.0, 20))[0],
+                         "ipv6")
+        # 差距在 margin_ms 以内不做调整
+        self.assertEqual(choose(v4, family_result("2001:db8::1", 1.0, 60), margin_ms=50)[0], "any")
+        self.assertEqual(choose(family_result("192.0.2.1", 0.0, None), family_result("2001:db8::1", 0.0, None)),
+                         ("any", "两者均不可达"))
+
+
+class MeasureConnectTest(unittest.TestCase):
+
+    def test_loopback_listener(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(8)
+            port = listener.getsockname()[1]
+            result = server_optimizer.measure_connect("127.0.0.1", socket.AF_INET, port, attempts=3, timeout=2)
+        self.assertEqual(result["address"], "127.0.0.1")
+        self.assertEqual(result["success_rate"], 1.0)
+        self.assertIsNotNone(result["latency_ms"])
+
+    def test_refused_and_missing_family(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            refused = server_optimizer.measure_connect("127.0.0.1", socket.AF_INET, port, attempts=2, timeout=2)
+        self.assertEqual((refused["address"], refused["success_rate"], refused["latency_ms"]),
+                         ("127.0.0.1", 0.0, None))
+        # IPv4字面地址没有IPv6记录
+        missing = server_optimizer.measure_connect("127.0.0.1", socket.AF_INET6, port, attempts=1)
+        self.assertIsNone(missing["address"])
+
+
+class IPPreferenceStepTest(unittest.TestCase):
+
+    HOSTS = "127.0.0.1 localhost\n140.82.112.3 github.com  # pinned\n"
+    GAI = "label ::1/128 0\n"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.hosts = os.path.join(self.tmp.name, "hosts")
+        self.gai = os.path.join(self.tmp.name, "gai.conf")
+        self.write(self.hosts, self.HOSTS)
+        self.write(self.gai, self.GAI)
+        for patcher in (mock.patch.object(server_optimizer, "HOSTS_FILE", self.hosts),
+                        mock.patch.object(server_optimizer, "GAI_CONF_FILE", self.gai)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.optimizer = server_optimizer.ServerOptimizer({
+            "ip_preference": {"endpoints": ["github.com", "gitee.com", "example.com"],
+                              "docker_endpoints": ["registry-1.docker.io"]},
+        })
+
+    @staticmethod
+    def write(path, content):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def test_read_pinned_hosts(self):
+        self.write(self.hosts, self.HOSTS + "# BEGIN server_optimizer ip_preference\n"
+                   "2001:db8::1 gitee.com\n# END server_optimizer ip_preference\n"
+                   "10.0.0.1 Mirror.Local mirror  # 注释\n")
+        pinned = server_optimizer.read_pinned_hosts(self.hosts, "ip_preference")
+        self.assertEqual(pinned, {"localhost": "127.0.0.1", "github.com": "140.82.112.3",
+                                  "mirror.local": "10.0.0.1", "mirror": "10.0.0.1"})
+        self.assertEqual(server_optimizer.read_pinned_hosts(self.hosts + ".missing", "ip_preference"), {})
+
+    def test_apply_and_revert(self):
+        measurements = [measurement("gitee.com", "ipv4"), measurement("example.com", "ipv4"),
+                        measurement("registry-1.docker.io", "ipv4", v4="192.0.2.9")]
+        with mock.patch.object(self.optimizer, "measure_ip_preference", return_value=measurements) as measure:
+            self.optimizer.optimize_ip_preference()
+        # github.com 已固定地址，不参与测量
+        self.assertEqual(measure.call_args.args[0], ["gitee.com", "example.com", "registry-1.docker.io"])
+
+        gai = self.read(self.gai)
+        self.assertTrue(gai.startswith(self.GAI))
+        self.assertIn("precedence ::ffff:0:0/96 100", gai)
+        hosts = self.read(self.hosts)
+        self.assertTrue(hosts.startswith(self.HOSTS))
+        # 全局IPv4优先后，只有Docker端点仍写入hosts
+        self.assertIn("192.0.2.9 registry-1.docker.io", hosts)
+        self.assertNotIn("gitee.com", hosts)
+
+        self.optimizer.revert_ip_preference()
+        self.assertEqual(self.read(self.gai), self.GAI)
+        self.assertEqual(self.read(self.hosts), self.HOSTS)
+
+    def test_no_endpoints_clears_both_blocks(self):
+        with mock.patch.object(self.optimizer, "measure_ip_preference",
+                               return_value=[measurement("gitee.com", "ipv6"), measurement("example.com", "ipv4")]):
+            self.optimizer.optimize_ip_preference()
+        self.assertNotEqual(self.read(self.hosts), self.HOSTS)
+        server_optimizer.update_managed_block(self.gai, "ip_preference", server_optimizer.GAI_PREFER_IPV4)
+
+        self.optimizer.profile["ip_preference"]["endpoints"] = ["github.com"]
+        self.optimizer.profile["ip_preference"]["docker_endpoints"] = []
+        with mock.patch.object(self.optimizer, "measure_ip_preference") as measure:
+            self.optimizer.optimize_ip_preference()
+        measure.assert_not_called()
+        self.assertEqual(self.read(self.gai), self.GAI)
+        self.assertEqual(self.read(self.hosts), self.HOSTS)
+
+    def test_unwritable_files_do_not_raise(self):
+        missing = os.path.join(self.tmp.name, "missing", "hosts")
+        with mock.patch.object(server_optimizer, "HOSTS_FILE", missing), \
+                mock.patch.object(self.optimizer, "measure_ip_preference",
+                                  return_value=[measurement("gitee.com", "ipv6")]), \
+                mock.patch("builtins.print") as output:
+            self.optimizer.optimize_ip_preference()
+            self.optimizer.revert_ip_preference()
+        printed = " ".join(str(call.args[0]) for call in output.call_args_list if call.args)
+        self.assertIn("无法写入IPv4/IPv6优先级配置", printed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""优化配置：继承与合并、查找顺序、推荐规则，以及 network 步骤写入的sysctl配置块"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  将仓库根目录加入sys.path
+
+import server_optimizer
+
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.user_dir = os.path.join(self.tmp.name, "user")
+        os.makedirs(self.user_dir)
+        patcher = mock.patch.object(server_optimizer, "USER_PROFILE_DIRS", [self.user_dir])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_profile(self, name: str, data) -> str:
+        path = os.path.join(self.user_dir, name + ".json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return path
+
+    def test_builtin_inheritance_and_null_deletion(self):
+        general = server_optimizer.load_profile("general")
+        database = server_optimizer.load_profile("database")
+
+        self.assertEqual(database["name"], "database")
+        self.assertEqual(database["steps"], ["dns", "network"])
+        # 字典逐项合并：覆盖的参数取子配置的值，其余继承自general
+        self.assertEqual(database["sysctl"]["vm.swappiness"], "1")
+        self.assertEqual(database["sysctl"]["net.ipv4.tcp_congestion_control"], "bbr")
+        self.assertEqual(database["dns"], general["dns"])
+        # null 删除继承来的参数
+        self.assertIn("net.ipv4.tcp_max_tw_buckets", general["sysctl"])
+        self.assertNotIn("net.ipv4.tcp_max_tw_buckets", database["sysctl"])
+        self.assertNotIn("inherits", database)
+
+    def test_merge_replaces_lists(self):
+        merged = server_optimizer._merge_profile(
+            {"a": {"x": 1, "y": [1, 2]}, "b": 1}, {"a": {"y": [3], "z": None}, "b": None})
+        self.assertEqual(merged, {"a": {"x": 1, "y": [3]}})
+
+    def test_user_profile_overrides_builtin(self):
+        path = self.write_profile("general", {"inherits": "general", "description": "本地通用配置"})
+        self.assertEqual(server_optimizer.find_profile("general"), path)
+
+        profile = server_optimizer.load_profile("general")
+        self.assertEqual(profile["path"], os.path.abspath(path))
+        self.assertEqual(profile["description"], "本地通用配置")
+        # 同名继承时使用内置配置作为父配置
+        self.assertIn("sysctl", profile)
+        self.assertIn("general", server_optimizer.list_profiles())
+        self.assertEqual(server_optimizer.list_profiles()["general"], path)
+
+    def test_profile_by_path(self):
+        path = self.write_profile("custom", {"inherits": "small_vps", "steps": ["dns"]})
+        self.assertEqual(server_optimizer.load_profile(path)["steps"], ["dns"])
+
+    def test_inheritance_cycle(self):
+        self.write_profile("a", {"inherits": "b"})
+        self.write_profile("b", {"inherits": "a"})
+        with self.assertRaisesRegex(ValueError, "循环继承"):
+            server_optimizer.load_profile("a")
+
+    def test_missing_profile(self):
+        with self.assertRaisesRegex(ValueError, "找不到优化配置: missing"):
+            server_optimizer.load_profile("missing")
+        self.write_profile("orphan", {"inherits": "missing"})
+        with self.assertRaisesRegex(ValueError, "找不到优化配置: missing"):
+            server_optimizer.load_profile("orphan")
+
+    def test_suggest_profile(self):
+        suggest = server_optimizer.suggest_profile
+        self.assertEqual(suggest(1024, 4, ["nginx"])[0], "small_vps")
+        self.assertEqual(suggest(8192, 1, [])[0], "small_vps")
+        name, reason = suggest(8192, 4, ["sshd", "postgres", "nginx"])
+        self.assertEqual(name, "database")
+        self.assertIn("postgres", reason)
+        self.assertEqual(suggest(8192, 4, ["caddy"])[0], "web_proxy")
+        self.assertEqual(suggest(8192, 4, ["Runner.Listener"])[0], "build_runner")
+        self.assertEqual(suggest(8192, 4, ["sshd"])[0], "general")
+        # 读取不到内存大小时不按小内存处理
+        self.assertEqual(suggest(0, 4, [])[0], "general")
+
+    def test_sysctl_changes(self):
+        changes = server_optimizer.sysctl_changes({
+            "net.core.somaxconn": "4096",
+            "vm.swappiness": 10,
+            "net.example.unknown": "1",
+            "net.ipv4.tcp_max_tw_buckets": None,
+        })
+        self.assertEqual(changes, [("vm.swappiness", "10", "60"), ("net.example.unknown", "1", "未知")])
+
+
+class OptimizeNetworkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.conf = os.path.join(self.tmp.name, "sysctl.conf")
+        with open(self.conf, "w") as f:
+            f.write("kernel.panic = 10\n")
+        patcher = mock.patch.object(server_optimizer, "SYSCTL_CONF_FILE", self.conf)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_network(self, profile_name: str):
+        optimizer = server_optimizer.ServerOptimizer(server_optimizer.load_profile(profile_name))
+        with mock.patch.object(optimizer, "run_command", return_value=True) as run_command:
+            optimizer.optimize_network()
+        return [call.args[0] for call in run_command.call_args_list]
+
+    def read_conf(self):
+        with open(self.conf, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_switching_profiles_replaces_block(self):
+        self.run_network("general")
+        self.run_network("general")
+        lines = self.read_conf()
+        self.assertEqual(lines[0], "kernel.panic = 10")
+        self.assertEqual(lines.count("net.ipv4.tcp_max_tw_buckets = 2000000"), 1)
+
+        commands = self.run_network("database")
+        lines = self.read_conf()
+        self.assertEqual(lines[0], "kernel.panic = 10")
+        self.assertIn("vm.swappiness = 1", lines)
+        self.assertFalse(any(line.startswith("net.ipv4.tcp_max_tw_buckets") for line in lines))
+        # 不再设置的参数恢复为内核默认值
+        self.assertIn("sysctl -w net.ipv4.tcp_max_tw_buckets=262144", commands)
+        self.assertEqual(commands[-1], f"sysctl -p {self.conf}")
+        self.assertEqual(len([line for line in lines if line.startswith("# BEGIN")]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
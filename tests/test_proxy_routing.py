@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""proxy_routing 步骤：本地HTTP代理和SOCKS5代理代替上游代理"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from support import make_file_handler, proxy, serve
+
+import server_optimizer
+
+
+def fetch_through_tunnel(base_url: str, proxy_url: str) -> bytes:
+    port = int(base_url.rsplit(":", 1)[1])
+    with server_optimizer.open_proxy_tunnel("127.0.0.1", port, proxy_url, timeout=5) as sock:
+        sock.sendall(b"GET /index HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return data
+            data += chunk
+
+
+class ProxyTunnelTest(unittest.TestCase):
+
+    def setUp(self):
+        context = serve(make_file_handler({"/index": b"hello"}))
+        self.base_url = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+    def test_http_connect(self):
+        with proxy(credentials=("user", "p@ss")) as (server, address):
+            response = fetch_through_tunnel(self.base_url, f"http://user:p%40ss@{address}")
+        self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+        self.assertTrue(response.endswith(b"hello"))
+        self.assertEqual(server.requests[0][0], "CONNECT")
+
+    def test_http_connect_rejected(self):
+        with proxy(connect_ports={443}) as (_, address):
+            with self.assertRaisesRegex(OSError, "代理拒绝CONNECT: HTTP/1.1 403"):
+                fetch_through_tunnel(self.base_url, f"http://{address}")
+
+    def test_http_connect_missing_credentials(self):
+        with proxy(credentials=("user", "secret")) as (_, address):
+            with self.assertRaisesRegex(OSError, "407"):
+                fetch_through_tunnel(self.base_url, f"http://{address}")
+
+    def test_socks5(self):
+        with proxy(credentials=("user", "secret")) as (server, address):
+            response = fetch_through_tunnel(self.base_url, f"socks5h://user:secret@{address}")
+        self.assertTrue(response.endswith(b"hello"))
+        self.assertEqual(server.requests[0][0], "SOCKS5")
+
+    def test_socks5_errors(self):
+        with proxy(credentials=("user", "secret")) as (_, address):
+            with self.assertRaisesRegex(OSError, "SOCKS5认证失败"):
+                fetch_through_tunnel(self.base_url, f"socks5://user:wrong@{address}")
+            with self.assertRaisesRegex(OSError, "不支持所需的认证方式"):
+                fetch_through_tunnel(self.base_url, f"socks5://{address}")
+        with proxy(socks_error=5) as (_, address):
+            with self.assertRaisesRegex(OSError, "错误码 5"):
+                fetch_through_tunnel(self.base_url, f"socks5://{address}")
+
+    def test_unsupported_scheme(self):
+        with proxy() as (_, address):
+            with self.assertRaisesRegex(OSError, "不支持的代理类型"):
+                fetch_through_tunnel(self.base_url, f"ftp://{address}")
+
+
+class ProxyRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.optimizer = server_optimizer.ServerOptimizer({"proxy_routing": {
+            "attempts": 1, "timeout": 3, "margin_ms": 50}})
+
+    def test_measure_route_direct_and_via_proxies(self):
+        with serve(make_file_handler({"/": b"x" * 100000})) as base_url, \
+                proxy() as (http_proxy, http_address), proxy() as (socks_proxy, socks_address):
+            direct = server_optimizer.measure_route(base_url + "/")
+            via_http = server_optimizer.measure_route(base_url + "/", f"http://{http_address}")
+            via_socks = server_optimizer.measure_route(base_url + "/", f"socks5://{socks_address}")
+
+        for result in (direct, via_http, via_socks):
+            self.assertTrue(result["ok"], result["error"])
+            self.assertGreater(result["throughput_kbps"], 0)
+        # 明文HTTP经由HTTP代理时发送绝对地址请求，而不是CONNECT
+        self.assertEqual(http_proxy.requests[0][:2], ("GET", base_url + "/"))
+        self.assertEqual(socks_proxy.requests[0][0], "SOCKS5")
+
+    def test_proxy_chosen_when_direct_unreachable(self):
+        with serve(make_file_handler({"/": b"ok"})) as base_url, \
+                proxy(hosts={"mirror.invalid": "127.0.0.1"}) as (_, address):
+            url = base_url.replace("127.0.0.1", "mirror.invalid") + "/"
+            routes = self.optimizer.measure_proxy_routes({"mirror.invalid": url}, [f"http://{address}"])
+
+        results = routes["mirror.invalid"]
+        self.assertEqual([r["ok"] for r in results], [True, False])
+        chosen, reason = self.optimizer.choose_proxy_route(results)
+        self.assertEqual(chosen, f"http://{address}")
+        self.assertIn("直连不可用", reason)
+
+    def test_direct_preferred_within_margin(self):
+        with serve(make_file_handler({"/": b"ok"})) as base_url, \
+                proxy(delay=0.3) as (_, slow), proxy() as (_, fast):
+            routes = self.optimizer.measure_proxy_routes(
+                {"local": base_url + "/"}, [f"http://{slow}", f"socks5://{fast}"])
+        chosen, reason = self.optimizer.choose_proxy_route(routes["local"])
+        self.assertIsNone(chosen)
+        self.assertIn("直连最快", reason)
+
+    def test_choose_proxy_route(self):
+        def result(proxy_url, total_ms, ok=True):
+            return {"proxy": proxy_url, "ok": ok, "total_ms": total_ms}
+
+        choose = self.optimizer.choose_proxy_route
+        # 代理明显更快
+        self.assertEqual(choose([result("socks5://p", 100), result(None, 400)])[0], "socks5://p")
+        # 代理更快但差距在 margin_ms 以内，仍然直连
+        self.assertIsNone(choose([result("socks5://p", 100), result(None, 140)])[0])
+        # 全部不可用
+        chosen, reason = choose([result(None, None, False), result("socks5://p", None, False)])
+        self.assertIsNone(chosen)
+        self.assertIn("所有路由均不可用", reason)
+
+
+def git(*args) -> str:
+    return subprocess.run(["git"] + list(args), check=True, capture_output=True, text=True).stdout.strip()
+
+
+@unittest.skipUnless(shutil.which("git"), "需要git")
+class ProxyRoutingStepTest(unittest.TestCase):
+    """生成PAC/环境变量文件、Git按URL代理和daemon.json，并撤销"""
+
+    PROXY = "socks5://127.0.0.1:1080"
+    DAEMON = {"registry-mirrors": ["https://docker.m.daocloud.io"]}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        home = os.path.join(self.tmp.name, "home")
+        os.makedirs(home)
+        self.daemon_file = os.path.join(self.tmp.name, "daemon.json")
+        with open(self.daemon_file, "w") as f:
+            json.dump(self.DAEMON, f)
+        for patcher in (
+            mock.patch.dict(os.environ, {"HOME": home, "GIT_CONFIG_NOSYSTEM": "1"}),
+            mock.patch.object(server_optimizer, "STATE_DIR", os.path.join(self.tmp.name, "state")),
+            mock.patch.object(server_optimizer, "DOCKER_DAEMON_FILE", self.daemon_file),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        git("config", "--global", "http.https://github.com/.proxy", "http://old-proxy:3128")
+
+        self.pac_file = os.path.join(self.tmp.name, "etc", "proxy.pac")
+        self.env_file = os.path.join(self.tmp.name, "etc", "proxy.env")
+        self.optimizer = server_optimizer.ServerOptimizer({
+            "docker": {"registry-mirrors": self.DAEMON["registry-mirrors"]},
+            "proxy_routing": {
+                "proxies": [self.PROXY],
+                "targets": {"github.com": "", "gitee.com": "", "registry-1.docker.io": ""},
+                "docker_domains": ["registry-1.docker.io"],
+                "pac_file": self.pac_file, "env_file": self.env_file, "margin_ms": 50,
+            },
+        })
+        run_command = self.optimizer.run_command
+        # 不真正重启Docker，git命令照常在临时HOME中执行
+        patcher = mock.patch.object(self.optimizer, "run_command", side_effect=lambda command, *args, **kwargs:
+                                    True if command.startswith("systemctl") else run_command(command, *args, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def routes(self):
+        def result(proxy_url, total_ms):
+            return {"proxy": proxy_url, "ok": True, "total_ms": total_ms, "connect_ms": 1, "ttfb_ms": 1,
+                    "throughput_kbps": 1, "error": None}
+        return {
+            "github.com": [result(self.PROXY, 100), result(None, 900)],
+            "gitee.com": [result(None, 50), result(self.PROXY, 400)],
+            "registry-1.docker.io": [result(self.PROXY, 100), result(None, 800)],
+        }
+
+    def read(self, path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def test_generate_and_revert(self):
+        with mock.patch.object(self.optimizer, "measure_proxy_routes", return_value=self.routes()):
+            self.optimizer.optimize_proxy_routing()
+
+        pac = self.read(self.pac_file)
+        self.assertIn('host == "github.com"', pac)
+        self.assertIn("SOCKS5 127.0.0.1:1080", pac)
+        self.assertNotIn("gitee.com", pac)
+        env = self.read(self.env_file).splitlines()
+        self.assertIn(f"https_proxy={self.PROXY}", env)
+        self.assertIn("no_proxy=localhost,127.0.0.1,::1,gitee.com", env)
+        self.assertEqual(git("config", "--global", "http.https://github.com/.proxy"), self.PROXY)
+        self.assertEqual(git("config", "--global", "http.https://gitee.com/.proxy"), "")
+        proxies = json.loads(self.read(self.daemon_file))["proxies"]
+        self.assertEqual(proxies["https-proxy"], self.PROXY)
+        # 国内镜像加速器直连
+        self.assertEqual(proxies["no-proxy"], "localhost,127.0.0.1,docker.m.daocloud.io")
+
+        # 再次运行不会覆盖记录的原值
+        with mock.patch.object(self.optimizer, "measure_proxy_routes", return_value=self.routes()):
+            self.optimizer.optimize_proxy_routing()
+
+        self.optimizer.revert_proxy_routing()
+        self.assertFalse(os.path.exists(self.pac_file))
+        self.assertFalse(os.path.exists(self.env_file))
+        self.assertEqual(json.loads(self.read(self.daemon_file)), self.DAEMON)
+        self.assertEqual(git("config", "--global", "--list"), "http.https://github.com/.proxy=http://old-proxy:3128")
+        self.assertEqual(server_optimizer.load_state("proxy_routing"), {})
+
+    def test_unwritable_files_reported(self):
+        blocker = os.path.join(self.tmp.name, "blocker")
+        open(blocker, "w").close()
+        self.optimizer.profile["proxy_routing"]["pac_file"] = os.path.join(blocker, "proxy.pac")
+        with mock.patch.object(self.optimizer, "measure_proxy_routes", return_value=self.routes()):
+            self.assertFalse(self.optimizer.run_step("proxy_routing"))
+        self.assertIn("proxy_routing", self.optimizer.failed_steps)
+
+
+if __name__ == "__main__":
+    unittest.main()